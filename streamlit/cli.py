@@ -0,0 +1,100 @@
+"""
+Run Coretax extractions without the Streamlit UI and write them to files.
+
+    python cli.py pajak_masukan --tin 0123... --taxpayer-id 123 --year 2025 --month 9
+    python cli.py lampiran --spt PPN --tin 0123... --taxpayer-id 123 --year 2025 --month 1 --month 2 --format Parquet
+    python cli.py a1 --tin 0123... --taxpayer-id 123 --year 2025 --out exports/
+    python cli.py batch --jobs month_end.json --max-jobs 8 --per-taxpayer 2
+
+A batch file is a JSON list of entries for utils.batch.expand_jobs, one
+per taxpayer. Every tin must be in the whitelist, as on the home page.
+Results go to <out>/<tin>/ with a manifest.json summary in <out>. The
+bearer token comes from --token or the CORETAX_TOKEN environment
+variable, unless a batch entry has its own. E-invoice reports run in
+delta-sync mode, fetching only faktur that are new or changed since the
+last run of the same query; CORETAX_CACHE=0 fetches them all again.
+Exits with status 1 when any job failed or missed records.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+from utils import batch, export, extract
+
+def show_progress(job, stage, done, total):
+    print(f"\r  {batch.job_name(job)} {stage}: {done}/{total}".ljust(60), end="", file=sys.stderr, flush=True)
+
+def show_done(record):
+    line = f"\r{record['status']:>7}  {batch.job_name(record)}  {record.get('rows', 0)} rows  {record['seconds']}s"
+    if record.get("failed"):
+        line += f"  {len(record['failed'])} failed"
+    if record.get("error"):
+        line += f"  {record['error']}"
+    print(line.ljust(60), file=sys.stderr)
+
+def parse_args(argv=None):
+    last_month = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+
+    parser = argparse.ArgumentParser(description="Extract Coretax reports to files, without the Streamlit UI.")
+    parser.add_argument("report", choices=batch.REPORTS + ["batch"])
+    parser.add_argument("--token", default=os.environ.get("CORETAX_TOKEN"), help="bearer token (default $CORETAX_TOKEN)")
+    parser.add_argument("--taxpayer-id", help="TaxpayerAggregateIdentifier")
+    parser.add_argument("--tin", help="NPWP, must be in the whitelist")
+    parser.add_argument("--year", type=int, default=last_month.year)
+    parser.add_argument(
+        "--month", dest="months", type=int, action="append", choices=range(1, 13), metavar="1-12",
+        help="repeat for several months (default: last month, or all of them for a1)"
+    )
+    parser.add_argument("--status", default="APPROVED", choices=["APPROVED", "CREDITED", "UNCREDITED"],
+                        help="TaxInvoiceStatus; CREDITED filters pajak_masukan on the crediting period")
+    parser.add_argument("--spt", choices=list(extract.SPT_TYPES), help="SPT for lampiran / bupot")
+    parser.add_argument("--jobs", help="batch file (JSON list of entries)")
+    parser.add_argument("--format", dest="formats", action="append", choices=list(export.FORMATS),
+                        help="repeat for several formats (default: Excel)")
+    parser.add_argument("--out", default=".", help="output directory")
+    parser.add_argument("--max-jobs", type=int, default=batch.MAX_JOBS, help="jobs running at once")
+    parser.add_argument("--per-taxpayer", type=int, default=batch.PER_TAXPAYER, help="jobs running at once per taxpayer")
+    args = parser.parse_args(argv)
+
+    if args.report == "batch":
+        if not args.jobs:
+            parser.error("batch needs --jobs")
+        with open(args.jobs, encoding="utf-8") as f:
+            entries = json.load(f)
+    else:
+        if not args.tin or not args.taxpayer_id:
+            parser.error(f"{args.report} needs --tin and --taxpayer-id")
+        entries = [{
+            "tin": args.tin,
+            "taxpayer_id": args.taxpayer_id,
+            "year": args.year,
+            "months": args.months or (list(range(1, 13)) if args.report == "a1" else [last_month.month]),
+            "report": args.report,
+            "spt": args.spt,
+            "invoice_status": args.status,
+        }]
+
+    try:
+        args.job_list = batch.expand_jobs(entries, token=args.token)
+    except ValueError as e:
+        parser.error(str(e))
+    args.formats = args.formats or ["Excel"]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    manifest = batch.run_batch(
+        args.job_list,
+        args.out,
+        formats=args.formats,
+        max_jobs=args.max_jobs,
+        per_taxpayer=args.per_taxpayer,
+        on_progress=show_progress,
+        on_done=show_done
+    )
+    print(f"→ {os.path.join(args.out, batch.MANIFEST)}", file=sys.stderr)
+    return 0 if all(record["status"] in ("ok", "empty") for record in manifest["jobs"]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
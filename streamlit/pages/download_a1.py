@@ -1,11 +1,10 @@
 import streamlit as st
 import requests
-import time
 import pandas as pd
-from utils import base
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import base, extract
 
 BASE_URL = base.BASE_URL
+JOB_KEY = "download_a1_job"
 
 st.set_page_config(page_title="Download A1", layout="centered", page_icon="📄")
 st.title("📄 Download A1")
@@ -38,7 +37,7 @@ spt_options = base.get_allowed_roles(roles)
 spt_options.pop('PPN')
 spt_options.pop('Unifikasi')
 
-period,year,rows = base.parameter_body(month_mapping)
+period,year = base.parameter_body(month_mapping)
 period_num = int(period[:2]) 
 spt_choice = st.selectbox(
     "Select Bupot",
@@ -51,188 +50,73 @@ else:
     st.warning("Not authorized for your role.")
     st.stop()
 
+income_months = st.multiselect(
+    "Select IncomePeriodCodeEnd month(s)",
+    options=list(month_mapping.keys()),
+    default=list(month_mapping.keys()),
+)
+
+# A job fetched for other parameters is no longer shown
+current_params = {"spt": spt_choice, "year": year, "months": income_months}
+if st.session_state.get("download_a1_params") != current_params:
+    base.drop_job(JOB_KEY)
+    st.session_state.download_a1_params = current_params
+
 # --- 3️⃣ Fetch Data ---
 if st.button("🔍 Fetch Data from Coretax"):
-    status_placeholder = st.empty()
-    status_placeholder.info("Fetching data from Coretax API...")
-    
-    download_list = []
     taxperiods = [
-        code + str(year)
-        for code in month_mapping.values()
+        month_mapping[month] + str(year)
+        for month in income_months
     ]
 
-    url = BASE_URL + "/withholdingslipsportal/api/getebupotbpa1issued"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    } 
-    
-    for taxperiod in taxperiods:
-        payload = {
-            "First": 0,
-            "Rows": rows,
-            "SortField": "",
-            "SortOrder": 1,
-            "Filters": [
-                {
-                    "PropertyName": "IncomePeriodCodeEnd",
-                    "Value": f"{taxperiod}",
-                    "MatchMode": "equals",
-                    "CaseSensitive": True,
-                    "AsString": False
-                }
-            ],
-            "LanguageId": "id-ID",
-            "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
-        }
-
-        try:
-            # st.write(payload)
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            records = data.get("Payload", {}).get("Data", [])
-            df = pd.json_normalize(records)
-            
-            # extract RecordIds from DataFrame
-            reverse_month_mapping = {v: k for k, v in month_mapping.items()}
-            if len(records) > 0:   
-                wanted_keys = {
-                    "WithholdingslipsAggregateIdentifier",
-                    "RecordId",
-                    "DocumentFormAggregateIdentifier",
-                    "LastUpdatedDate",
-                    "TaxIdentificationNumber",
-                    "Name"
-                }
-
-                download_list.extend(
-                    {k: r.get(k) for k in wanted_keys}
-                    for r in records
-                )
-            
-        except requests.exceptions.RequestException as e:
-            status_placeholder.empty()
-            st.warning(f"⚠️ Failed to retrieve download request: {e}")
-                   
-    st.success(f"✅ Success! Retrieved download request {len(download_list)} files.")
-    status_placeholder.empty()
-    # st.write(download_list)
-        
-    # get details for all months
-    MAX_WORKERS = 3
-    MAX_RETRIES = 3
-
-    status_placeholder.info("Starting download from Coretax API...")
-
-    total = len(download_list)
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    details = []
-    fails = []
-
-    url = BASE_URL + "/withholdingslipsportal/api/DownloadWithholdingSlips/download-pdf-document"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    
-    def download_pdf(row):
-        payload = {
-            "WithholdingSlipsAggregateIdentifier": row["WithholdingslipsAggregateIdentifier"],
-            "WithholdingSlipsRecordIdentifier": row["RecordId"],
-            "DocumentAggregateIdentifier": row["DocumentFormAggregateIdentifier"],
-            "TaxpayerAggregateIdentifier": taxpayer_id,
-            "EbupotType": "EBUPOTBPA1",
-            "DocumentDate": row["LastUpdatedDate"],
-            "TaxIdentificationNumber": row["TaxIdentificationNumber"],
-        }
-
-        for attempt in range(1, MAX_RETRIES + 1):
+    # Runs on the server's job pool, across reruns; the page only polls it.
+    # All period listings run at once; each listed bupot goes straight into
+    # the download pool, so early months download while later ones still list
+    base.run_in_background(
+        JOB_KEY,
+        f"Bupot A1 {year}",
+        extract.archive_a1,
+        token,
+        taxpayer_id,
+        taxperiods
+    )
+
+job = base.job_status(JOB_KEY)
+
+# --- 4️⃣ Compile PDF into ZIP ---
+if job is not None and not job.active:
+    if job.state == "cancelled":
+        st.info("Download cancelled.")
+    elif job.state == "error":
+        if isinstance(job.error, requests.exceptions.RequestException):
+            st.error(f"Request failed: {job.error}")
+        else:
+            st.error(f"Error: {job.error}")
+    else:
+        sink, zip_file, fails, list_errors = job.result
+        for taxperiod, e in list_errors:
+            st.warning(f"⚠️ Failed to retrieve download request for {taxperiod}: {e}")
+        if fails:
+            st.warning(f"⚠️ {len(fails)} Bupot gagal download, Coba download manual untuk:")
+            for i,fail in enumerate(fails):
+                st.warning(f"{i+1}. {fail['TaxIdentificationNumber']} - {fail['Name']}")
+        st.success(f"✅ Downloaded {sink.count} files successfully")
+
+        if zip_file is not None:
             try:
-                resp = requests.post(
-                    url,
-                    headers=headers,
-                    json=payload,
-                    timeout=(10, 120),
+                if sink.report is not None:
+                    st.caption("Compression policy comparison for this archive")
+                    st.dataframe(pd.DataFrame(sink.report.summary()).T)
+
+                # the archive stays on disk with the job; it is only read when clicked
+                st.download_button(
+                    "📁 Download Bupot A1",
+                    data=base.file_data(zip_file),
+                    file_name="bupot_a1.zip",
+                    mime="application/zip",
+                    on_click="ignore"
                 )
-                resp.raise_for_status()
-
-                data = resp.json()
-                content = data.get("Content")
-                filename = f"{row['Name']}.pdf"
-
-                if not content:
-                    raise ValueError("Empty PDF content")
-
-                return {
-                    "success": True,
-                    "data": {
-                        "Content": content,
-                        "FileName": filename,
-                    },
-                }
-
             except Exception as e:
-                if attempt == MAX_RETRIES:
-                    return {
-                        "success": False,
-                        "row": row,
-                        "error": str(e),
-                    }
-
-                time.sleep(1 * attempt)  # simple backoff
-                
-    completed = 0
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [
-            executor.submit(download_pdf, row)
-            for row in download_list
-        ]
-
-        for future in as_completed(futures):
-            result = future.result()
-            completed += 1
-
-            status_text.info(f"Fetching file {completed}/{total}")
-            progress_bar.progress(completed / total)
-
-            if result["success"]:
-                details.append(result["data"])
-            else:
-                fails.append(result["row"])
-    
-    status_text.empty()
-    progress_bar.empty()
-
-    if fails:
-        st.warning(f"⚠️ {len(fails)} Bupot gagal download, Coba download manual untuk:")
-        for i,fail in enumerate(fails):
-            st.warning(f"{i+1}. {fail["TaxIdentificationNumber"]} - {fail["Name"]}")
-    st.success(f"✅ Downloaded {len(details)} files successfully")
-
-# --- 4️⃣ Compile PDF into ZIP ---                
-    if details:
-        try:
-            status_placeholder.empty()
-            status_placeholder.info("Compiling into zip file...")
-            
-            zip_buffer = base.build_zip_in_memory(details)
-            
-            st.download_button(
-                "📁 Download Bupot A1",
-                data=zip_buffer,
-                file_name="bupot_a1.zip",
-                mime="application/zip"
-            )
-            status_placeholder.empty()
-        except Exception as e:
-            st.error(f"Error: {e}")
-    else:
-        st.warning("No details were retrieved.")   
-        
-    
-
+                st.error(f"Error: {e}")
+        else:
+            st.warning("No details were retrieved.")
@@ -1,16 +1,12 @@
 import streamlit as st
 import requests
-import time
 import datetime
 import calendar
 import pandas as pd
-import io
-import zipfile
-import base64
-from utils import base
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import base, extract
 
 BASE_URL = base.BASE_URL
+JOB_KEY = "download_bupot_job"
 
 st.set_page_config(page_title="Download Bupot - Dokumen Saya", layout="centered", page_icon="📄")
 st.title("📄 Download Bupot - Dokumen Saya")
@@ -48,210 +44,69 @@ else:
     st.warning("Not authorized for your role.")
     st.stop()   
 
+# A job fetched for other parameters is no longer shown
+current_params = {"spt": spt_choice, "date": date}
+if st.session_state.get("download_bupot_params") != current_params:
+    base.drop_job(JOB_KEY)
+    st.session_state.download_bupot_params = current_params
+
 # --- 3️⃣ Fetch Data ---
 if st.button("🔍 Fetch Data from Coretax"):
-    status_placeholder = st.empty()
-    status_placeholder.info("Fetching data from Coretax API...")
-    
-    download_list = []
-
-    url = BASE_URL + "/documentmanagementportal/api/list/listTaxpayerDocuments"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    } 
-    
-    payload = {
-        "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
-        "IsCaseCompleted": True,
-        "IsSkipInvoiceDocument": False,
-        "First": 0,
-        "Rows": 10000,
-        "SortField": "CreationDatetime",
-        "SortOrder": 1,
-        "Filters": [
-            {
-                "PropertyName": "DocumentDate",
-                "Value": [
-                    f"{date[0].strftime("%Y/%m/%d")}",
-                    f"{date[1].strftime("%Y/%m/%d")}"
-                ],
-                "MatchMode": "between",
-                "CaseSensitive": True,
-                "AsString": False
-            },
-            {
-                "PropertyName": "DocumentTitle",
-                "Value": f"{search_key}",
-                "MatchMode": "startsWith",
-                "CaseSensitive": False,
-                "AsString": False
-            }
-        ],
-        "LanguageId": "id-ID"
-    }
-
-    try:
-        # st.write(payload)
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        records = data.get("Payload", {}).get("Data", [])
-        df = pd.json_normalize(records)
-        
-        # extract RecordIds from DataFrame
-        if len(records) > 0:   
-            wanted_keys = {
-                "AggregateIdentifier",
-                "DocumentNumber",
-                "LetterNumber",
-            }
-
-            download_list.extend(
-                {k: r.get(k) for k in wanted_keys}
-                for r in records
-            )
+    # Runs on the server's job pool, across reruns; the page only polls it
+    base.run_in_background(
+        JOB_KEY,
+        f"Bupot {spt_choice}",
+        extract.archive_bupot,
+        token,
+        taxpayer_id,
+        search_key,
+        date[0],
+        date[1]
+    )
+
+job = base.job_status(JOB_KEY)
+
+# --- 4️⃣ Compile PDF into ZIP ---
+if job is not None and not job.active:
+    if job.state == "cancelled":
+        st.info("Download cancelled.")
+    elif job.state == "error":
+        if isinstance(job.error, requests.exceptions.RequestException):
+            st.warning(f"⚠️ Failed to retrieve download request: {job.error}")
         else:
-            status_placeholder.empty()
-            st.warning(f"No records found for {spt_choice} - {date[0].strftime("%Y/%m/%d")} ~ {date[1].strftime("%Y/%m/%d")}")
+            st.error(f"Error: {job.error}")
+    else:
+        download_list, sink, zip_file, fails, error = job.result
+        if not download_list:
+            st.warning(f"No records found for {spt_choice} - {date[0].strftime('%Y/%m/%d')} ~ {date[1].strftime('%Y/%m/%d')}")
             st.stop()
-        
-    except requests.exceptions.RequestException as e:
-        status_placeholder.empty()
-        st.warning(f"⚠️ Failed to retrieve download request: {e}")
-        
-                   
-    st.success(f"✅ Success! Retrieved download request {len(download_list)} files.")
-    status_placeholder.empty()
-    # st.write(download_list)
-        
-    # get details for all months
-    MAX_WORKERS = 3
-    MAX_RETRIES = 3
-
-    status_placeholder.info("Starting download from Coretax API...")
 
-    total = len(download_list)
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    details = []
-    fails = []
-
-    url = BASE_URL + "/documentmanagementportal/api/download"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    
-    def download_pdf(row):
-        payload = {
-            "DocumentId": row["DocumentNumber"],
-            "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
-            "IsNeedWatermark": True,
-            "FormCallerName": "TaxpayerDocuments",
-            "DocumentAggregateIdentifier": row["AggregateIdentifier"]
-        }
-
-        for attempt in range(1, MAX_RETRIES + 1):
+        st.success(f"✅ Success! Retrieved download request {len(download_list)} files.")
+        if error is not None:
+            # whatever had already been downloaded is still zipped
+            done, total = job.progress.get("download", (0, len(download_list)))
+            st.error(f"⚠️ Download stopped early after {done}/{total} files: {error}")
+        if fails:
+            st.warning(f"⚠️ {len(fails)} Bupot gagal download, Coba download manual untuk:")
+            for i,fail in enumerate(fails):
+                st.warning(f"{i+1}. {fail['LetterNumber']}")
+        st.success(f"✅ Downloaded {sink.count} files successfully")
+
+        if zip_file is not None:
             try:
-                resp = requests.post(
-                    url,
-                    headers=headers,
-                    json=payload,
-                    timeout=(10, 120),
+                if sink.report is not None:
+                    st.caption("Compression policy comparison for this archive")
+                    st.dataframe(pd.DataFrame(sink.report.summary()).T)
+
+                # the archive stays on disk with the job; it is only read when clicked
+                st.download_button(
+                    "📁 Download Bupot",
+                    data=base.file_data(zip_file),
+                    file_name=f"bupot_{spt_choice.lower()}.zip",
+                    mime="application/zip",
+                    on_click="ignore"
                 )
-                resp.raise_for_status()
-
-                content = resp.content
-                filename = f"{row['LetterNumber']}.pdf"
-
-                if not content:
-                    raise ValueError("Empty PDF content")
-
-                return {
-                    "success": True,
-                    "data": {
-                        "Content": content,
-                        "FileName": filename,
-                    },
-                }
-
             except Exception as e:
-                if attempt == MAX_RETRIES:
-                    return {
-                        "success": False,
-                        "row": row,
-                        "error": str(e),
-                    }
-
-                time.sleep(1 * attempt)  # simple backoff
-                
-    completed = 0
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [
-            executor.submit(download_pdf, row)
-            for row in download_list
-        ]
-
-        for future in as_completed(futures):
-            result = future.result()
-            completed += 1
-
-            status_text.info(f"Fetching file {completed}/{total}")
-            progress_bar.progress(completed / total)
-
-            if result["success"]:
-                details.append(result["data"])
-            else:
-                fails.append(result["row"])
-    
-    status_text.empty()
-    progress_bar.empty()
-
-    if fails:
-        st.warning(f"⚠️ {len(fails)} Bupot gagal download, Coba download manual untuk:")
-        for i,fail in enumerate(fails):
-            st.warning(f"{i+1}. {fail["LetterNumber"]}")
-    st.success(f"✅ Downloaded {len(details)} files successfully")
-
-# --- 4️⃣ Compile PDF into ZIP ---                
-    if details:
-        try:
-            status_placeholder.empty()
-            status_placeholder.info("Compiling into zip file...")
-            
-            zip_buffer = io.BytesIO()
-            total = len(details)
-
-            progress = st.progress(0)
-            status = st.empty()
-
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for i,r in enumerate(details, start=1):
-                    status.info(f"Zipping {i}/{total}")
-                    pdf_bytes = r["Content"]
-                    filename = r.get("FileName", "file.pdf")
-                    zipf.writestr(filename, pdf_bytes)
-                    progress.progress(i / total)
-
-            status.empty()
-            progress.empty()
-
-            zip_buffer.seek(0)
-            
-            st.download_button(
-                "📁 Download Bupot",
-                data=zip_buffer,
-                file_name=f"bupot_{spt_choice.lower()}.zip",
-                mime="application/zip"
-            )
-            status_placeholder.empty()
-        except Exception as e:
-            st.error(f"Error: {e}")
-    else:
-        st.warning("No details were retrieved.")   
-        
-    
-
+                st.error(f"Error: {e}")
+        else:
+            st.warning("No details were retrieved.")
@@ -1,11 +1,11 @@
 import streamlit as st
 import requests
 import pandas as pd
-import io
-from utils import base
-from utils import parse_lampiran
+from utils import base, export, extract
+from utils import lampiran_schema
 
 BASE_URL = base.BASE_URL
+JOB_KEY = "lampiran_spt_job"
 
 st.set_page_config(page_title="Lampiran SPT", layout="centered", page_icon="📄")
 st.title("📄 Lampiran SPT")
@@ -36,7 +36,7 @@ month_mapping = {
 }
 spt_options = base.get_allowed_roles(roles)
 
-period,year,rows = base.parameter_body(month_mapping)
+period,year = base.parameter_body(month_mapping)
 period_num = int(period[:2]) 
 spt_choice = st.selectbox(
     "Select SPT",
@@ -48,181 +48,72 @@ if spt_choice is not None:
 else:
     st.warning("No SPT available for your role.")
     st.stop()
+export_formats = st.multiselect("Export formats", list(export.FORMATS), default=["Excel"])
+
+# A job fetched for other parameters is no longer shown
+current_params = {"spt": spt_choice, "period": period, "year": year}
+if st.session_state.get("lampiran_params") != current_params:
+    base.drop_job(JOB_KEY)
+    st.session_state.lampiran_params = current_params
 
 # --- 3️⃣ Fetch Data ---
+reverse_month_mapping = {v: k for k, v in month_mapping.items()}
 if st.button("🔍 Fetch Data from Coretax"):
-    status_placeholder = st.empty()
-    status_placeholder.info("Fetching data from Coretax API...")
-    
-    taxperiod = period + str(year)
-   
-    url = BASE_URL + "/returnsheetportal/api/returnsheetssubmitted"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    } 
-    payload = {
-        "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
-        "isArchieved": False,
-        "First": 0,
-        "Rows": rows,
-        "SortField": "",
-        "SortOrder": 1,
-        "Filters": [
-            {
-                "PropertyName": "TaxTypeCode",
-                "Value": [
-                    f"{spt_type}"
-                ],
-                "MatchMode": "contains",
-                "CaseSensitive": True,
-                "AsString": False
-            },
-            {
-                "PropertyName": "TaxPeriodCode",
-                "Value": f"{taxperiod}",
-                "MatchMode": "equals",
-                "CaseSensitive": True,
-                "AsString": False
-            }
-        ],
-        "LanguageId": "id-ID"
-    }
-    try:
-        # st.write(payload)
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        records = data.get("Payload", {}).get("Data", [])
-        df = pd.json_normalize(records)
-        
-        # extract RecordIds from DataFrame
-        reverse_month_mapping = {v: k for k, v in month_mapping.items()}
-        if len(records) == 0:
-            month_name = reverse_month_mapping[period]
-            status_placeholder.empty()
-            st.warning(f"No records found for {month_name} {year}")
-            st.stop()
-            
-        record_ids = df["RecordId"].dropna().tolist()
-        st.success(f"✅ Success! Retrieved SPT {spt_choice} {reverse_month_mapping[period]} {year} records.")
-        status_placeholder.empty()
-        
-        # get details for all headers
-        status_placeholder.info("Fetching details from Coretax API...")
-        details = []
-        match spt_choice:
-            case 'PPN':
-                api_urls = [
-                    "/returnsheetportal/api/loadndvat/la1-grid",
-                    "/returnsheetportal/api/loadndvat/la2-grid",
-                    "/returnsheetportal/api/loadndvat/lb1-grid",
-                    "/returnsheetportal/api/loadndvat/lb2-grid",
-                    "/returnsheetportal/api/loadndvat/lb3-grid",
-                ]
-            case 'PPh21':
-                api_urls = [
-                    "/returnsheetportal/api/loadarticle2126/l1a-grid",
-                    "/returnsheetportal/api/loadarticle2126/l1b-bpa1-grid",
-                    "/returnsheetportal/api/loadarticle2126/l2-bpa1-grid",
-                    "/returnsheetportal/api/loadarticle2126/l3-bp21-grid"
-                ]
-            case 'Unifikasi':
-                api_urls = [
-                    "/returnsheetportal/api/loadwtr/list-i-bpu-grid"
-                ]
-        for i, rid in enumerate(record_ids):
-            for api_url in api_urls:
-                # Ping KeepAlive every 10 requests
-                if i % 50 == 0:
-                    base.keepalive(token)
-                    
-                url = BASE_URL + api_url
-                headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                }
-                
-                if spt_choice == 'PPN':
-                    payload = {
-                        "ReturnSheetRecordId": f"{rid}",
-                        "IsNormalVAT": True,
-                        "First": 0,
-                        "Rows": rows,
-                        "SortField": "",
-                        "SortOrder": 1,
-                        "Filters": [],
-                        "LanguageId": "id-ID",
-                        "TaxpayerAggregateIdentifier": f"{taxpayer_id}"
-                    }
-                else:
-                    payload = {
-                        "ReturnSheetRecordId": f"{rid}",
-                        "First": 0,
-                        "Rows": rows,
-                        "SortField": "",
-                        "SortOrder": 1,
-                        "Filters": [],
-                        "LanguageId": "id-ID",
-                        "TaxpayerAggregateIdentifier": f"{taxpayer_id}"
-                    }
+    # Runs on the server's job pool, across reruns; the page only polls it
+    base.run_in_background(
+        JOB_KEY,
+        f"SPT {spt_choice} {reverse_month_mapping[period]} {year}",
+        extract.fetch_lampiran_sheets,
+        spt_choice,
+        token,
+        taxpayer_id,
+        period_num,
+        int(year)
+    )
+
+job = base.job_status(JOB_KEY)
 
-                try:
-                    resp = requests.post(url, headers=headers, json=payload)
-                    resp.raise_for_status()
-                    detail_data = resp.json()
-                    
-                    if len(detail_data) == 0:
-                        details.append('')
-                    else:
-                        details.append(detail_data.get("Payload", detail_data))
-                        
-                except requests.exceptions.RequestException as e:
-                    status_placeholder.empty()
-                    st.warning(f"⚠️ Failed to fetch details for RecordId {rid}: {e}")
-                
-    except requests.exceptions.RequestException as e:
-        status_placeholder.empty()
-        st.error(f"Request failed: {e}")
+# --- 4️⃣ Process Data into Excel ---
+if job is not None and not job.active:
+    if job.state == "cancelled":
+        st.info("Fetch cancelled.")
+    elif job.state == "error":
+        if isinstance(job.error, requests.exceptions.RequestException):
+            st.error(f"Request failed: {job.error}")
+        else:
+            st.error(f"Error: {job.error}")
+    else:
+        record_ids, dfs, grid_fails = job.result
+        if len(record_ids) == 0:
+            st.warning(f"No records found for {reverse_month_mapping[period]} {year}")
+        else:
+            st.success(f"✅ Success! Retrieved SPT {spt_choice} {reverse_month_mapping[period]} {year} records.")
+        for rid, api_url in grid_fails:
+            st.warning(f"⚠️ Failed to fetch {api_url.rsplit('/', 1)[-1]} for RecordId {rid}")
 
-# --- 4️⃣ Process Data into Excel ---                
-    if details:
-        try:
-            status_placeholder.empty()
-            st.success(f"✅ Fetched details for {len(details)} records.")
-            status_placeholder.info("Compiling into Excel...")
-            
-            dfs = parse_lampiran(spt_choice,details)
-            for name, df in dfs.items():
-                if not df.empty:
-                    df.insert(0, "Masa", period_num)  
-                    
-            # Summary        
-            # st.dataframe(details)
-            # st.dataframe(dfs["L-III"])
-            summary = pd.DataFrame([
-                {"Sheet Name": name, "Record Count": len(df)}
-                for name, df in dfs.items()
-            ])
+        if dfs:
+            try:
+                st.success(f"✅ Fetched {sum(len(df) for df in dfs.values())} rows in {len(dfs)} sheets.")
 
-            st.dataframe(summary)
+                # Summary
+                summary = pd.DataFrame([
+                    {"Sheet Name": name, "Record Count": len(df)}
+                    for name, df in dfs.items()
+                ])
 
-            # Export to excel
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                for sheet_name, dataframe in dfs.items():
-                    dataframe.to_excel(writer, index=False, sheet_name=sheet_name)
-            st.download_button(
-                "📊 Download Details Excel",
-                data=output.getvalue(),
-                file_name=f"{spt_choice}_lampiran_details.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-            status_placeholder.empty()
-        except Exception as e:
-            st.error(f"Error: {e}")
-    else:
-        st.warning("No details were retrieved.")   
-        
-    
+                st.dataframe(summary)
 
+                # Export to excel
+                date_columns = {c for df in dfs.values() for c in df.columns if str(c).endswith("Date")}
+                base.export_buttons(
+                    base.job_memo(JOB_KEY, job),
+                    export_formats,
+                    dfs,
+                    f"{spt_choice}_lampiran_details",
+                    schemas={name: lampiran_schema(name) for name in dfs},
+                    date_columns=date_columns
+                )
+            except Exception as e:
+                st.error(f"Error: {e}")
+        elif record_ids:
+            st.warning("No details were retrieved.")
@@ -1,10 +1,10 @@
 import streamlit as st
 import requests
-import pandas as pd
-import io
-from utils import base
+from utils import base, flatten, export, extract
 
 BASE_URL = base.BASE_URL
+JOB_KEY = "retur_keluaran_job"
+PARAMS_KEY = "retur_keluaran_params"
 
 st.set_page_config(page_title="Retur Keluaran", layout="centered", page_icon="⚖️")
 st.title("⚖️ Retur Keluaran")
@@ -16,214 +16,90 @@ taxpayer_name = st.session_state.get("taxpayer_name", None)
 base.auth_header(token,taxpayer_id,taxpayer_name)
     
 # --- 2️⃣ Parameters ---
-period,year,rows = base.parameter_body()
+period,year = base.parameter_body()
 current_params = {
     "period": period,  # list → tuple (hashable)
     "year": year,
 }
-if "last_params" not in st.session_state:
-    st.session_state.last_params = current_params
+# Per page, so other pages' parameters never cancel this page's job
+if PARAMS_KEY not in st.session_state:
+    st.session_state[PARAMS_KEY] = current_params
 else:
-    if st.session_state.last_params != current_params:
-        for key in ["cursor", "details", "fails"]:
-            st.session_state.pop(key, None)
+    if st.session_state[PARAMS_KEY] != current_params:
+        base.drop_job(JOB_KEY)
 
-        st.session_state.last_params = current_params
-        st.info("🔄 Parameters changed — progress reset.")
+        st.session_state[PARAMS_KEY] = current_params
+        st.info("🔄 Parameters changed — records already fetched for them are kept on disk.")
         
 # st.warning('Coretax Error - Faktur tidak bisa difilter berdasarkan status. Program akan menarik SEMUA FAKTUR per bulan', icon="⚠️")
 
+delta_sync = st.checkbox(
+    "⚡ Delta sync — only fetch new or changed faktur",
+    value=True,
+    help="Untick to fetch every faktur again from Coretax."
+)
+resume = st.checkbox("↩️ Resume an unfinished fetch, keeping the details it already has", value=True)
+export_formats = st.multiselect("Export formats", list(export.FORMATS), default=["Excel"])
+
 # --- 3️⃣ Fetch Data ---
+report_name = "retur_keluaran"
+report = extract.INVOICE_REPORTS[report_name]
 if st.button("🔍 Fetch Data from Coretax"):
-    status_placeholder = st.empty()
-    status_placeholder.info("Fetching data from Coretax API...")
-   
-    url = BASE_URL + "/einvoiceportal/api/outputreturn/list"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    } 
-    payload = {
-        "SellerTaxpayerAggregateIdentifier": f"{taxpayer_id}",
-        "First": 0,
-        "Rows": rows,
-        "SortField": "",
-        "SortOrder": 1,
-        "Filters": [
-            {
-                "PropertyName": "TaxInvoicePeriod",
-                "Value": period,
-                "MatchMode": "contains",
-                "CaseSensitive": True,
-                "AsString": False
-            },
-            {
-                "PropertyName": "TaxInvoiceYear",
-                "Value": year,
-                "MatchMode": "equals",
-                "CaseSensitive": True,
-                "AsString": False
-            }    
-            ,
-            {
-                "PropertyName": "TaxInvoiceStatus",
-                "Value": "APPROVED",
-                "MatchMode": "equals",
-                "CaseSensitive": True,
-                "AsString": False
-            }
-        ],
-        "LanguageId": "id-ID",
-        "TaxpayerAggregateIdentifier": f"{taxpayer_id}"
-    }
-    try:
-        # st.write(payload)
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        records = data.get("Payload", {}).get("Data", [])
-        df = pd.json_normalize(records)
-        
-        # extract RecordIds from DataFrame
-        if len(records) == 0:
-            month_name  = base.reverse_month_mapping(period)
-            status_placeholder.empty()
-            st.warning(f"No records found for {month_name} {year}")
-            st.stop()
-            
-        record_ids = df["RecordId"].dropna().tolist()
-        st.success(f"✅ Success! Retrieved {len(record_ids)} records.")
-        status_placeholder.empty()
-        
-        # get details for all headers
-        url = BASE_URL + "/einvoiceportal/api/outputreturn/view"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        details = base.fetch_details(record_ids,token,taxpayer_id,url,headers)
-        
-    except requests.exceptions.RequestException as e:
-        status_placeholder.empty()
-        st.error(f"Request failed: {e}")
-
-# --- 4️⃣ Process Data into Excel ---                
-    if details:
-        try:
-            status_placeholder.empty()
-            df_details = pd.json_normalize(details)
-            st.success(f"✅ Fetched details for {len(df_details)} records.")
-            # st.dataframe(details)
-            status_placeholder.info("Compiling into Excel...")
-            payloads = details
-            
-            all_rows = []
-            
-            # TO DO make this output for retur
-            column_map = {
-                "FormDataObj_TransactionDocumentData_ReturnDate": "tanggal",
-                "FormDataObj_TransactionDocumentData_ReturnDocumentNumber": "nota",
-                "BuyerTIN": "relasi",
-                "kode": "kode",
-                "qtybox": "qtybox",
-                "qtylsn": "qtylsn",
-                "FormDataObj_TransactionDetailsData_ReturnQuantity": "qtypcs",
-                "hrgbox": "hrgbox",
-                "hrglsn": "hrglsn",
-                "FormDataObj_TransactionDetailsData_UnitPrice": "hrgpcs",
-                "FormDataObj_TransactionDetailsData_ReturnDiscount": "discount",
-                "FormDataObj_TransactionDetailsData_VATRate": "ppn",
-                "FormDataObj_TransactionDocumentData_TaxInvoicePeriod": "sptmasa",
-                "jmldpp": "jmldpp",
-                "FormDataObj_TransactionDetailsData_ReturnVAT": "jmlppn",
-                "BuyerTaxpayerName": "nmsup",
-                "FormDataObj_TransactionDetailsData_Name": "nmbrg",
-                "InvoiceStatus": "divisi",
-                "FormDataObj_TransactionDocumentData_Reference": "ref"
-            }
-
-            month_end_map = {
-                "TD.00701": "/01/31",
-                "TD.00702": "/02/28",
-                "TD.00703": "/03/31",
-                "TD.00704": "/04/30",
-                "TD.00705": "/05/31",
-                "TD.00706": "/06/30",
-                "TD.00707": "/07/31",
-                "TD.00708": "/08/31",
-                "TD.00709": "/09/30",
-                "TD.00710": "/10/31",
-                "TD.00711": "/11/30",
-                "TD.00712": "/12/31",
-            }
-
-            for payload in payloads:  # assume this is your list of invoices
-                inv_details = payload["FormDataObj"]["TransactionDetailsData"]["Rows"]
-                for d in inv_details:
-                    period_code = payload.get("FormDataObj", {}).get("TransactionDocumentData", {}).get("TaxInvoicePeriod", "")
-                    year = payload.get("FormDataObj", {}).get("TransactionDocumentData", {}).get("TaxInvoiceYear", "")
-
-                    sptmasa_value = base.get_period_end_date(period_code, year)
-
-                    row = {
-                        # pull in detail-level fields
-                        # "FormDataObj_TransactionDetailsData_Type": d.get("Type", ""),
-                        "FormDataObj_TransactionDetailsData_Name": d.get("Name", ""),
-                        # "FormDataObj_TransactionDetailsData_Code": d.get("Code", ""),
-                        "FormDataObj_TransactionDetailsData_ReturnQuantity": d.get("ReturnQuantity", 0),
-                        # "FormDataObj_TransactionDetailsData_Unit": d.get("Unit", ""),
-                        "FormDataObj_TransactionDetailsData_UnitPrice": d.get("UnitPrice", 0),
-                        "FormDataObj_TransactionDetailsData_ReturnDiscount": d.get("ReturnDiscount", 0),
-                        "FormDataObj_TransactionDetailsData_VATRate": d.get("VATRate", 0),
-                        # "FormDataObj_TransactionDetailsData_ReturnTaxBase": d.get("ReturnTaxBase", 0),
-                        "FormDataObj_TransactionDetailsData_ReturnVAT": d.get("ReturnVAT", 0),
-
-                        # include parent-level info from FormDataObj_TransactionDocumentData
-                        "FormDataObj_TransactionDocumentData_ReturnDate": payload.get("FormDataObj", {}).get("TransactionDocumentData", {}).get("ReturnDate", ""),
-                        "FormDataObj_TransactionDocumentData_ReturnDocumentNumber": payload.get("FormDataObj", {}).get("TransactionDocumentData", {}).get("ReturnDocumentNumber", ""),
-                        "FormDataObj_TransactionDocumentData_Reference": payload.get("FormDataObj", {}).get("TransactionDocumentData", {}).get("Reference", ""),
-                        "FormDataObj_TransactionDocumentData_TaxInvoicePeriod": sptmasa_value,
-
-                        # add seller info
-                        "BuyerTIN": payload.get("BuyerTIN", ""),
-                        "BuyerTaxpayerName": payload.get("BuyerTaxpayerName", ""),
-                        "InvoiceStatus": payload.get("InvoiceStatus", ""),
-                    }
-                    all_rows.append(row)
-
-            df_all = pd.DataFrame(all_rows)
-            df_all.rename(columns=column_map, inplace=True)
-
-            # Ensure all target columns exist
-            for col in column_map.values():
-                if col not in df_all.columns:
-                    df_all[col] = ""
-                    
-            # Reorder safely
-            df_all = df_all[list(column_map.values())]
-            df_all["tanggal"] = df_all["tanggal"].apply(base.format_date)
-            df_all = df_all.loc[df_all["qtypcs"] > 0]
-            df_all["jmldpp"] = (df_all["hrgpcs"] * df_all["qtypcs"]) - df_all["discount"]
-
-            # st.write(df_all.columns.tolist())
-            status_placeholder.empty()
-            st.dataframe(df_all)
-
-            # Export to excel
-            excel_buffer = io.BytesIO()
-            df_all.to_excel(excel_buffer, index=False, engine="openpyxl")
-            st.download_button(
-                "📊 Download Details Excel",
-                data=excel_buffer.getvalue(),
-                file_name="coretax_output_return_details.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        except Exception as e:
-            status_placeholder.empty()
-            st.error(f"Error: {e}")
+    # Runs on the server's job pool, across reruns; the page only polls it
+    base.run_in_background(
+        JOB_KEY,
+        f"Retur Keluaran {base.reverse_month_mapping(period)} {year}",
+        extract.fetch_invoice_batches,
+        report_name,
+        token,
+        taxpayer_id,
+        period,
+        year,
+        delta=delta_sync,
+        resume=resume
+    )
+
+job = base.job_status(JOB_KEY)
+
+# --- 4️⃣ Process Data into Excel ---
+if job is not None and not job.active:
+    if job.state == "cancelled":
+        st.info("Fetch cancelled.")
+    elif job.state == "error":
+        if isinstance(job.error, requests.exceptions.RequestException):
+            st.error(f"Request failed: {job.error}")
+        else:
+            st.error(f"Error: {job.error}")
     else:
-        status_placeholder.empty()
-        st.warning("No details were retrieved.")   
-        
-    
-
+        # the job keeps compact Arrow batches; the frame is built once per job
+        batches, fails = job.result
+        memo = base.job_memo(JOB_KEY, job)
+        if "frame" not in memo:
+            memo["frame"] = extract.invoice_frame(report_name, batches)
+        df_all = memo["frame"]
+        if fails:
+            st.warning(
+                f"⚠️ {len(fails)} records could not be fetched. "
+                "Click 🔍 Fetch Data from Coretax again to retry them."
+            )
+        if len(df_all) == 0:
+            if fails:
+                st.warning("No details were retrieved.")
+            else:
+                st.warning(f"No records found for {base.reverse_month_mapping(period)} {year}")
+        else:
+            try:
+                st.success(f"✅ Fetched details for {len(df_all)} records.")
+                st.dataframe(df_all)
+
+                # Export to excel
+                base.export_buttons(
+                    memo,
+                    export_formats,
+                    {"Sheet1": df_all},
+                    report["file_name"],
+                    schemas={"Sheet1": flatten.EXPORT_SCHEMA},
+                    date_columns=flatten.DATE_COLUMNS
+                )
+            except Exception as e:
+                st.error(f"Error: {e}")
@@ -1,5 +1,6 @@
 # utils/__init__.py
-from .parser import parse_lampiran
-from . import base
+from .parser import parse_lampiran, lampiran_schema
 
-__all__ = ["parse_lampiran","base"]
+# base (the Streamlit helpers) is imported on demand, so the headless
+# modules (coretax, extract) load without Streamlit
+__all__ = ["parse_lampiran","lampiran_schema","base"]
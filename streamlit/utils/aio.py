@@ -0,0 +1,84 @@
+import asyncio
+import atexit
+import threading
+import time
+import aiohttp
+from . import coretax, throttle
+
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+_semaphore = None
+
+def get_loop():
+    """
+    Single event loop for the whole server process, running on its own
+    daemon thread so it never blocks (or is blocked by) a Streamlit rerun.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="coretax-aio",
+                    daemon=True
+                )
+                thread.start()
+                _loop = loop
+    return _loop
+
+async def _get_client():
+    """Shared aiohttp session + concurrency semaphore, created on the loop thread."""
+    global _client, _semaphore
+    if _client is None or _client.closed:
+        connect, read = coretax.REQUEST_TIMEOUT
+        _semaphore = asyncio.Semaphore(coretax.ASYNC_CONCURRENCY)
+        _client = aiohttp.ClientSession(
+            headers=coretax.DEFAULT_HEADERS,
+            # shared across tokens, so no cookies are kept (see coretax.get_session)
+            cookie_jar=aiohttp.DummyCookieJar(),
+            connector=aiohttp.TCPConnector(
+                limit=coretax.ASYNC_CONCURRENCY,
+                limit_per_host=coretax.ASYNC_CONCURRENCY,
+                keepalive_timeout=60,
+            ),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+        )
+    return _client
+
+async def fetch_one(rid, url, headers, taxpayer_id):
+    """Async twin of coretax.fetch_one."""
+    client = await _get_client()
+    limiter = coretax.get_limiter("view")
+    payload = coretax.detail_payload(rid, url, taxpayer_id)
+    async with _semaphore:
+        await limiter.acquire_async()
+        started = time.monotonic()
+        try:
+            async with client.post(url, headers=headers, json=payload) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+        except Exception as e:
+            limiter.release(time.monotonic() - started, throttle.classify(exc=e))
+            raise
+        limiter.release(time.monotonic() - started)
+    return data.get("Payload", {})
+
+def close():
+    """Close the shared aiohttp session when the server process exits."""
+    if _loop is not None and _client is not None and not _client.closed:
+        try:
+            submit(_client.close()).result(timeout=5)
+        except Exception:
+            pass
+
+atexit.register(close)
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop, returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def submit_fetch(rid, url, headers, taxpayer_id):
+    return submit(fetch_one(rid, url, headers, taxpayer_id))
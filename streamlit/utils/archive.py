@@ -0,0 +1,217 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+ZIP_POLICY = os.environ.get("CORETAX_ZIP_POLICY", "auto")        # "store", "deflate" or "auto"
+ZIP_MEASURE = os.environ.get("CORETAX_ZIP_MEASURE", "0") == "1"
+DEFLATE_LEVEL = 6
+SAMPLE_BYTES = 64 * 1024
+MIN_SAVING = 0.05       # "auto" only deflates entries whose sample shrinks by at least 5%
+QUEUE_SIZE = 32         # entries waiting for the writer thread, bounds memory
+
+def choose_compression(data, policy=ZIP_POLICY):
+    """
+    zipfile compression for one entry under `policy`.
+    Coretax PDFs are already compressed internally, so "auto" test-deflates
+    the first SAMPLE_BYTES and stores the entry when that saves almost nothing.
+    """
+    if policy == "store":
+        return zipfile.ZIP_STORED
+    if policy == "deflate":
+        return zipfile.ZIP_DEFLATED
+    sample = data[:SAMPLE_BYTES]
+    if not sample:
+        return zipfile.ZIP_STORED
+    saved = 1 - len(zlib.compress(sample, 1)) / len(sample)
+    return zipfile.ZIP_DEFLATED if saved >= MIN_SAVING else zipfile.ZIP_STORED
+
+class CompressionReport:
+    """
+    Bytes saved vs. time spent per policy, measured on the real entries.
+    Every entry is deflated once to time it, whatever policy is writing.
+    """
+
+    def __init__(self):
+        self.entries = 0
+        self.raw_bytes = 0
+        self.deflated_bytes = 0
+        self.deflate_seconds = 0.0
+        self.auto_bytes = 0
+        self.auto_seconds = 0.0
+
+    def add(self, data):
+        started = time.perf_counter()
+        choice = choose_compression(data, "auto")
+        sample_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        deflated = len(zlib.compress(data, DEFLATE_LEVEL))
+        deflate_seconds = time.perf_counter() - started
+
+        self.entries += 1
+        self.raw_bytes += len(data)
+        self.deflated_bytes += deflated
+        self.deflate_seconds += deflate_seconds
+        if choice == zipfile.ZIP_DEFLATED:
+            self.auto_bytes += deflated
+            self.auto_seconds += sample_seconds + deflate_seconds
+        else:
+            self.auto_bytes += len(data)
+            self.auto_seconds += sample_seconds
+
+    def summary(self):
+        return {
+            "store": {"bytes_saved": 0, "seconds": 0.0},
+            "deflate": {
+                "bytes_saved": self.raw_bytes - self.deflated_bytes,
+                "seconds": round(self.deflate_seconds, 3),
+            },
+            "auto": {
+                "bytes_saved": self.raw_bytes - self.auto_bytes,
+                "seconds": round(self.auto_seconds, 3),
+            },
+        }
+
+class ZipSink:
+    """
+    ZIP archive written entry by entry to a temp file on disk.
+    Each PDF is added as soon as its download finishes, so memory use
+    stays flat however many files go in. add() only queues the entry; a
+    background writer thread picks the compression (see choose_compression)
+    and writes it, so zipping overlaps with the downloads and never blocks
+    the Streamlit thread. Large downloads can instead be streamed into a
+    file from stage() and queued with add_file(). finish() hands back the
+    finished archive as an open file.
+    """
+
+    def __init__(self, policy=ZIP_POLICY, measure=ZIP_MEASURE, dir=None):
+        handle = tempfile.NamedTemporaryFile(suffix=".zip", dir=dir, delete=False)
+        self.path = handle.name
+        self.policy = policy
+        self.report = CompressionReport() if measure else None
+        self._zip = zipfile.ZipFile(handle, "w", zipfile.ZIP_STORED, compresslevel=DEFLATE_LEVEL)
+        self._handle = handle
+        self._names = set()
+        self._staging = None
+        self._staging_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, name="zip-writer", daemon=True)
+        self._writer.start()
+        self._count_lock = threading.Lock()
+        self.count = 0
+
+    def _unique_name(self, filename):
+        # Two bupot for the same person would otherwise overwrite each other
+        name = filename
+        stem, ext = os.path.splitext(filename)
+        n = 1
+        while name in self._names:
+            n += 1
+            name = f"{stem} ({n}){ext}"
+        self._names.add(name)
+        return name
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            filename, data, path = item
+            try:
+                if path is None:
+                    self._write_bytes(filename, data)
+                else:
+                    self._write_file(filename, path)
+            except Exception as e:
+                self._error = e
+
+    def _write_bytes(self, filename, data):
+        self._zip.writestr(
+            self._unique_name(filename),
+            data,
+            compress_type=choose_compression(data, self.policy)
+        )
+        if self.report is not None:
+            self.report.add(data)
+
+    def _write_file(self, filename, path):
+        with open(path, "rb") as f:
+            sample = f.read(SAMPLE_BYTES)
+        self._zip.write(
+            path,
+            self._unique_name(filename),
+            compress_type=choose_compression(sample, self.policy)
+        )
+        if self.report is not None:
+            with open(path, "rb") as f:
+                self.report.add(f.read())
+        os.unlink(path)
+
+    def add(self, filename, data):
+        """Queue one entry; blocks only while QUEUE_SIZE entries are already waiting."""
+        self._put(filename, data, None)
+
+    def stage(self):
+        """
+        Path of a fresh file in this archive's staging directory, for a
+        download to stream into before add_file(). Anything still staged
+        is removed together with the archive.
+        """
+        with self._staging_lock:
+            if self._staging is None:
+                self._staging = tempfile.mkdtemp(prefix="coretax-staging-", dir=os.path.dirname(self.path))
+        fd, path = tempfile.mkstemp(suffix=".part", dir=self._staging)
+        os.close(fd)
+        return path
+
+    def add_file(self, filename, path):
+        """Queue a file on disk as one entry; the file is deleted once written."""
+        self._put(filename, None, path)
+
+    def _put(self, filename, data, path):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((filename, data, path))
+        with self._count_lock:
+            self.count += 1
+
+    def _close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._zip.close()
+        self._handle.close()
+        if self._staging is not None:
+            shutil.rmtree(self._staging, ignore_errors=True)
+
+    def finish(self):
+        """
+        Close the archive and return it opened for reading. The temp file is
+        unlinked straight away where the OS allows, so it disappears once the
+        returned handle is closed or garbage collected.
+        """
+        self._close()
+        if self._error is not None:
+            self.discard()
+            raise self._error
+        archive = open(self.path, "rb")
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        return archive
+
+    def discard(self):
+        if self._writer.is_alive():
+            self._close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,260 @@
+import calendar
+import collections
+import datetime
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import archive, coretax, export, extract, flatten
+from .parser import lampiran_schema
+
+MAX_JOBS = int(os.environ.get("CORETAX_BATCH_JOBS", 8))                # jobs running at once, all taxpayers
+PER_TAXPAYER = int(os.environ.get("CORETAX_BATCH_PER_TAXPAYER", 2))    # jobs running at once per taxpayer
+MANIFEST = "manifest.json"
+REPORTS = list(extract.INVOICE_REPORTS) + ["lampiran", "a1", "bupot"]
+
+def job_name(job):
+    """Short label of a job, e.g. 'pajak_masukan 2025-09' or 'lampiran PPN 2025-09'."""
+    spt = f" {job['spt']}" if job.get("spt") else ""
+    return f"{job['report']}{spt} {job['year']}-{job['month']:02d}"
+
+def expand_jobs(entries, token=None):
+    """
+    Jobs from a batch file: each entry names one taxpayer (taxpayer_id,
+    and its tin, which must be in coretax.WHITELIST as on the home page) with
+    "reports" × "months" of one "year", e.g.
+        {"tin": "...", "taxpayer_id": "...", "token": "...", "year": 2025,
+         "months": [9], "reports": ["pajak_masukan", "lampiran"], "spt": "PPN"}
+    "report" / "month" work for a single one, "spt" may be a list and
+    "invoice_status" (default APPROVED) filters the e-invoice reports.
+    `token` is used for entries without their own.
+    Everything is validated before anything runs, including that no job
+    is asked for twice; raises ValueError.
+    """
+    jobs = []
+    seen = set()
+    for i, entry in enumerate(entries, start=1):
+        tin = entry.get("tin")
+        if not tin:
+            raise ValueError(f"Entry {i}: no tin")
+        if tin not in coretax.WHITELIST:
+            raise ValueError(f"Entry {i}: {tin} is not registered")
+        if not entry.get("taxpayer_id"):
+            raise ValueError(f"Entry {i}: no taxpayer_id")
+        if not (entry.get("token") or token):
+            raise ValueError(f"Entry {i}: no token")
+
+        reports = entry.get("reports") or [entry.get("report")]
+        months = entry.get("months") or [entry.get("month")]
+        spts = entry.get("spt")
+        spts = spts if isinstance(spts, list) else [spts]
+        for report in reports:
+            if report not in REPORTS:
+                raise ValueError(f"Entry {i}: unknown report {report!r}")
+            for month in months:
+                if month not in range(1, 13):
+                    raise ValueError(f"Entry {i}: bad month {month!r}")
+                for spt in spts if report in ("lampiran", "bupot") else [None]:
+                    if report in ("lampiran", "bupot") and spt not in extract.SPT_TYPES:
+                        raise ValueError(f"Entry {i}: {report} needs an spt, one of {list(extract.SPT_TYPES)}")
+                    job = {
+                        "token": entry.get("token") or token,
+                        "taxpayer_id": entry["taxpayer_id"],
+                        "tin": tin,
+                        "report": report,
+                        "year": int(entry["year"]),
+                        "month": month,
+                        "spt": spt,
+                        "invoice_status": entry.get("invoice_status", "APPROVED") if report in extract.INVOICE_REPORTS else None,
+                    }
+                    # two runs of one job would write the same files at once
+                    key = (tin, report, job["year"], month, spt, job["invoice_status"])
+                    if key in seen:
+                        raise ValueError(f"Entry {i}: {job_name(job)} is already in the batch")
+                    seen.add(key)
+                    jobs.append(job)
+    return jobs
+
+def _save(handle, path):
+    with handle, open(path, "wb") as f:
+        shutil.copyfileobj(handle, f)
+    return path
+
+def _export(sheets, formats, stem, schemas, date_columns):
+    files = []
+    for fmt in formats:
+        handle, ext, _ = export.write(fmt, sheets, schemas=schemas, date_columns=date_columns)
+        files.append(_save(handle, f"{stem}.{ext}"))
+    return files
+
+def _finish(sink, path):
+    if sink.count:
+        return [_save(sink.finish(), path)]
+    sink.discard()
+    return []
+
+def _run_invoices(job, folder, formats, on_progress):
+    report = extract.INVOICE_REPORTS[job["report"]]
+    df, fails = extract.fetch_invoices(
+        job["report"],
+        job["token"],
+        job["taxpayer_id"],
+        list(coretax.month_mapping.values())[job["month"] - 1],
+        job["year"],
+        status=job["invoice_status"],
+        on_progress=on_progress,
+        delta=True
+    )
+    files = []
+    if len(df):
+        files = _export(
+            {"Sheet1": df},
+            formats,
+            os.path.join(folder, f"{report['file_name']}_{job['invoice_status'].lower()}_{job['year']}{job['month']:02d}"),
+            {"Sheet1": flatten.EXPORT_SCHEMA},
+            flatten.DATE_COLUMNS
+        )
+    return len(df), [str(rid) for rid in fails], files
+
+def _run_lampiran(job, folder, formats, on_progress):
+    spt = job["spt"]
+    _, dfs, grid_fails = extract.fetch_lampiran_sheets(
+        spt, job["token"], job["taxpayer_id"], job["month"], job["year"], on_progress
+    )
+    fails = [f"{rid} {api_url.rsplit('/', 1)[-1]}" for rid, api_url in grid_fails]
+    if not dfs:
+        return 0, fails, []
+
+    files = _export(
+        dfs,
+        formats,
+        os.path.join(folder, f"{spt}_lampiran_details_{job['year']}{job['month']:02d}"),
+        {name: lampiran_schema(name) for name in dfs},
+        {c for df in dfs.values() for c in df.columns if str(c).endswith("Date")}
+    )
+    return sum(len(df) for df in dfs.values()), fails, files
+
+def _run_a1(job, folder, formats, on_progress):
+    sink = archive.ZipSink()
+    list_errors = []
+    fails = extract.download_a1(
+        job["token"],
+        job["taxpayer_id"],
+        [extract.tax_period(job["month"], job["year"])],
+        sink,
+        on_progress=on_progress,
+        on_list_error=lambda taxperiod, e: list_errors.append(e)
+    )
+    files = _finish(sink, os.path.join(folder, f"bupot_a1_{job['year']}{job['month']:02d}.zip"))
+    if list_errors:
+        raise list_errors[0]
+    return sink.count, [f"{row['TaxIdentificationNumber']} - {row['Name']}" for row in fails], files
+
+def _run_bupot(job, folder, formats, on_progress):
+    year, month = job["year"], job["month"]
+    rows = extract.list_bupot(
+        job["token"],
+        job["taxpayer_id"],
+        extract.SPT_TYPES[job["spt"]]["search_key"],
+        datetime.date(year, month, 1),
+        datetime.date(year, month, calendar.monthrange(year, month)[1])
+    )
+    sink = archive.ZipSink()
+    try:
+        fails = extract.download_bupot(job["token"], job["taxpayer_id"], rows, sink, on_progress=on_progress)
+    finally:
+        # whatever was downloaded before an error is still kept
+        files = _finish(sink, os.path.join(folder, f"bupot_{job['spt'].lower()}_{year}{month:02d}.zip"))
+    return sink.count, [row["LetterNumber"] for row in fails], files
+
+def run_job(job, out, formats=("Excel",), on_progress=None):
+    """
+    Run one job into out/<tin>/ and return its manifest
+    record (the job without its token, plus status, rows, failed items,
+    files and seconds). Status is "ok", "partial" (some items could not
+    be fetched), "empty" (nothing listed) or "error". Never raises.
+    on_progress(job, stage, done, total) as in utils.extract.
+    """
+    started = time.monotonic()
+    record = {k: v for k, v in job.items() if k != "token" and v is not None}
+    folder = os.path.join(out, str(job["tin"]))
+    progress = (lambda stage, done, total: on_progress(job, stage, done, total)) if on_progress else None
+
+    if job["report"] in extract.INVOICE_REPORTS:
+        runner = _run_invoices
+    else:
+        runner = {"lampiran": _run_lampiran, "a1": _run_a1, "bupot": _run_bupot}[job["report"]]
+
+    try:
+        os.makedirs(folder, exist_ok=True)
+        rows, fails, files = runner(job, folder, formats, progress)
+        record.update(
+            status="partial" if fails else "ok" if rows else "empty",
+            rows=rows,
+            failed=fails,
+            files=[os.path.relpath(path, out) for path in files],
+        )
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["seconds"] = round(time.monotonic() - started, 1)
+    return record
+
+def write_manifest(path, manifest):
+    """Replace the manifest file in one step, so it is never half written."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+def run_batch(jobs, out, formats=("Excel",), max_jobs=MAX_JOBS, per_taxpayer=PER_TAXPAYER, on_progress=None, on_done=None):
+    """
+    Run jobs (see expand_jobs) concurrently and return the manifest.
+    At most max_jobs run at once, and at most per_taxpayer of those for
+    the same taxpayer; queued jobs are started in order, skipping past a
+    taxpayer that is already at its limit so the others keep going.
+    All jobs share the process-wide connection pool and the adaptive
+    request limiters of utils.coretax, which cap requests in flight for
+    the whole batch. out/manifest.json is rewritten after every finished
+    job, so an interrupted batch still shows what is done.
+    on_done(record) is called on this thread as each job finishes.
+    """
+    os.makedirs(out, exist_ok=True)
+    path = os.path.join(out, MANIFEST)
+    manifest = {
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "finished": None,
+        "formats": list(formats),
+        "jobs": [],
+    }
+    max_jobs = max(1, max_jobs)
+    per_taxpayer = max(1, per_taxpayer)
+    queued = list(jobs)
+    running = {}
+    busy = collections.Counter()
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        while queued or running:
+            i = 0
+            while i < len(queued) and len(running) < max_jobs:
+                job = queued[i]
+                if busy[job["taxpayer_id"]] >= per_taxpayer:
+                    i += 1
+                    continue
+                queued.pop(i)
+                busy[job["taxpayer_id"]] += 1
+                running[executor.submit(run_job, job, out, formats, on_progress)] = job
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                busy[job["taxpayer_id"]] -= 1
+                record = future.result()
+                manifest["jobs"].append(record)
+                write_manifest(path, manifest)
+                if on_done is not None:
+                    on_done(record)
+
+    manifest["finished"] = datetime.datetime.now().isoformat(timespec="seconds")
+    write_manifest(path, manifest)
+    return manifest
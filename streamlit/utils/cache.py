@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlparse
+
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".coretax")
+CACHE_ENABLED = os.environ.get("CORETAX_CACHE", "1") != "0"
+CACHE_PATH = os.environ.get("CORETAX_CACHE_PATH", os.path.join(DATA_DIR, "details.sqlite"))
+CACHE_TTL = float(os.environ.get("CORETAX_CACHE_TTL", 30 * 24 * 3600))     # seconds
+CACHE_MAX_MB = float(os.environ.get("CORETAX_CACHE_MAX_MB", 1024))
+BATCH = 500     # keeps IN (...) lists under SQLite's variable limit
+
+# Header (list) fields that change whenever an invoice's detail can change
+DELTA_FIELDS = (
+    "LastUpdatedDate",
+    "SellerLastUpdatedDate",
+    "TaxInvoiceStatus",
+    "InputInvoiceStatus",
+    "BuyerStatus",
+    "InvoiceStatus",
+    "ESignStatus",
+    "PeriodCredit",
+    "YearCredit",
+    "AmendedRecordId",
+    "Valid",
+)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def endpoint_key(url):
+    """Cache key part for an endpoint: the URL path, e.g. /einvoiceportal/api/inputinvoice/view"""
+    return urlparse(url).path
+
+def fingerprint(record):
+    """
+    Hash of a list record's change-tracking fields (DELTA_FIELDS), or of the
+    whole record when none of them are present.
+    """
+    fields = {k: record[k] for k in DELTA_FIELDS if k in record}
+    blob = json.dumps(fields or record, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+def private_dir(path):
+    """
+    Create the directory of the database file `path` readable by this
+    user only, since it holds taxpayer invoice data. DATA_DIR is also
+    tightened when an older version created it with default permissions.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if directory == os.path.abspath(DATA_DIR):
+        os.chmod(directory, 0o700)
+
+def scope_key(scope):
+    return json.dumps(scope, sort_keys=True, default=str)
+
+class DetailCache:
+    """
+    Persistent cache of `view` payloads in SQLite, keyed by
+    (endpoint, RecordIdentifier, taxpayer). Payloads are stored as
+    zlib-compressed JSON, with the fingerprint of the list record they
+    were fetched for, so a payload is only reused while the record is
+    unchanged. Entries older than `ttl` seconds are ignored and evicted,
+    except those a delta-sync manifest still refers to for the same
+    fingerprint, and the least recently used ones are evicted once the
+    total stored size passes `max_bytes`.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        private_dir(path)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS details (
+                endpoint TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                taxpayer_id TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                fingerprint TEXT,
+                PRIMARY KEY (endpoint, record_id, taxpayer_id)
+            )
+            """
+        )
+        # caches written before fingerprints were stored
+        if "fingerprint" not in {row[1] for row in conn.execute("PRAGMA table_info(details)")}:
+            conn.execute("ALTER TABLE details ADD COLUMN fingerprint TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS details_accessed ON details (accessed_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS manifests (
+                endpoint TEXT NOT NULL,
+                taxpayer_id TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                PRIMARY KEY (endpoint, taxpayer_id, scope, record_id)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS manifests_record ON manifests (endpoint, taxpayer_id, record_id)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections must stay on the thread that opened them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, url, record_ids, taxpayer_id, ttl=None, fingerprints=None):
+        """
+        Return {record_id: payload} for every fresh cached record. With
+        `fingerprints` ({record_id: fingerprint} of the current list
+        records) a payload stored for a different fingerprint, or none,
+        is left out.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        endpoint = endpoint_key(url)
+        now = time.time()
+        found = {}
+        conn = self._conn()
+
+        for i in range(0, len(record_ids), BATCH):
+            batch = [str(r) for r in record_ids[i:i + BATCH]]
+            marks = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT record_id, payload, fingerprint FROM details "
+                f"WHERE endpoint = ? AND taxpayer_id = ? AND stored_at >= ? AND record_id IN ({marks})",
+                [endpoint, str(taxpayer_id), now - ttl, *batch]
+            ).fetchall()
+            if fingerprints is not None:
+                rows = [row for row in rows if row[2] is not None and row[2] == fingerprints.get(row[0])]
+            for rid, blob, _ in rows:
+                found[rid] = json.loads(zlib.decompress(blob))
+
+            if rows:
+                conn.execute(
+                    f"UPDATE details SET accessed_at = ? "
+                    f"WHERE endpoint = ? AND taxpayer_id = ? AND record_id IN ({','.join('?' * len(rows))})",
+                    [now, endpoint, str(taxpayer_id), *(rid for rid, _, _ in rows)]
+                )
+        conn.commit()
+        return found
+
+    def put_many(self, url, items, taxpayer_id, fingerprints=None):
+        """
+        Store (record_id, payload) pairs, with their list record's
+        fingerprint from `fingerprints` when given, then evict down to
+        max_bytes.
+        """
+        if not items:
+            return
+        endpoint = endpoint_key(url)
+        now = time.time()
+        rows = []
+        for rid, payload in items:
+            blob = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+            fp = fingerprints.get(str(rid)) if fingerprints is not None else None
+            rows.append((endpoint, str(rid), str(taxpayer_id), blob, len(blob), now, now, fp))
+
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO details "
+            "(endpoint, record_id, taxpayer_id, payload, size, stored_at, accessed_at, fingerprint) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries no manifest refers to (delta sync reads those
+        regardless of age), then least recently used ones until under
+        max_bytes.
+        """
+        conn = self._conn()
+        conn.execute(
+            """
+            DELETE FROM details WHERE stored_at < ? AND NOT EXISTS (
+                SELECT 1 FROM manifests m
+                WHERE m.endpoint = details.endpoint AND m.taxpayer_id = details.taxpayer_id
+                AND m.record_id = details.record_id AND m.fingerprint = details.fingerprint
+            )
+            """,
+            (time.time() - self.ttl,)
+        )
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM details").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            freed = 0
+            doomed = []
+            for rowid, size in conn.execute("SELECT rowid, size FROM details ORDER BY accessed_at"):
+                doomed.append((rowid,))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM details WHERE rowid = ?", doomed)
+        conn.commit()
+
+    def get_manifest(self, url, taxpayer_id, scope):
+        """{record_id: fingerprint} saved by the previous run of the same query."""
+        rows = self._conn().execute(
+            "SELECT record_id, fingerprint FROM manifests WHERE endpoint = ? AND taxpayer_id = ? AND scope = ?",
+            (endpoint_key(url), str(taxpayer_id), scope_key(scope))
+        ).fetchall()
+        return dict(rows)
+
+    def save_manifest(self, url, taxpayer_id, scope, fingerprints):
+        """Replace the manifest of a query with {record_id: fingerprint}."""
+        key = (endpoint_key(url), str(taxpayer_id), scope_key(scope))
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM manifests WHERE endpoint = ? AND taxpayer_id = ? AND scope = ?",
+            key
+        )
+        conn.executemany(
+            "INSERT INTO manifests VALUES (?, ?, ?, ?, ?)",
+            [(*key, str(rid), fp) for rid, fp in fingerprints.items()]
+        )
+        conn.commit()
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM details")
+        conn.execute("DELETE FROM manifests")
+        conn.commit()
+
+def get_cache():
+    """Process-wide DetailCache, or None when CORETAX_CACHE=0."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DetailCache()
+    return _cache
@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from .cache import DATA_DIR, fingerprint, private_dir
+
+CHECKPOINTS_ENABLED = os.environ.get("CORETAX_CHECKPOINTS", "1") != "0"
+CHECKPOINT_PATH = os.environ.get("CORETAX_CHECKPOINT_PATH", os.path.join(DATA_DIR, "checkpoints.sqlite"))
+CHECKPOINT_TTL = float(os.environ.get("CORETAX_CHECKPOINT_TTL", 24 * 3600))    # seconds after its start a run stays resumable
+FLUSH_EVERY = 200       # payloads written to disk per commit while a run is fetching
+
+_store = None
+_store_lock = threading.Lock()
+
+def _pack(obj):
+    return zlib.compress(json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+def run_key(taxpayer_id, report, **params):
+    """Checkpoint key of one extraction, e.g. run_key(id, "pajak_masukan", period=..., year=..., status=...)."""
+    return json.dumps({"taxpayer_id": str(taxpayer_id), "report": report, **params}, sort_keys=True, default=str)
+
+class Writer:
+    """on_result hook that adds (record_id, payload) to a checkpoint FLUSH_EVERY at a time."""
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.items = []
+
+    def __call__(self, record_id, payload):
+        self.items.append((record_id, payload))
+        if len(self.items) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.store.add(self.key, self.items)
+        self.items = []
+
+class CheckpointStore:
+    """
+    Progress of unfinished extractions in SQLite, so a later run, in this
+    or any other process sharing the file, carries on where one stopped.
+    A checkpoint holds the list snapshot the run works through, every
+    payload fetched so far (zlib-compressed JSON, one row per RecordId)
+    and the RecordIds that failed on the last attempt with a retryable
+    error. Unlike the detail cache nothing here is evicted while the run
+    is unfinished; checkpoints started more than `ttl` seconds ago are
+    dropped, however often they were resumed since.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH, ttl=CHECKPOINT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        private_dir(path)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                key TEXT PRIMARY KEY,
+                records BLOB NOT NULL,
+                fails TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS payloads (
+                key TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                PRIMARY KEY (key, record_id)
+            )
+            """
+        )
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections must stay on the thread that opened them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def load(self, key):
+        """(list records, failed RecordIds) of an unfinished run, or None."""
+        self.expire()
+        row = self._conn().execute("SELECT records, fails FROM runs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return _unpack(row[0]), json.loads(row[1])
+
+    def start(self, key, records):
+        """Begin a checkpoint from a fresh list snapshot, dropping any older one."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM payloads WHERE key = ?", (key,))
+        conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)", (key, _pack(records), "[]", now, now))
+        conn.commit()
+
+    def refresh(self, key, records):
+        """
+        Swap the run's list snapshot for a fresh listing, dropping stored
+        payloads of records that changed (by cache.fingerprint) or are no
+        longer listed, so the resumed run fetches those again.
+        """
+        conn = self._conn()
+        row = conn.execute("SELECT records FROM runs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.start(key, records)
+            return
+        old = {str(r["RecordId"]): fingerprint(r) for r in _unpack(row[0]) if r.get("RecordId") is not None}
+        new = {str(r["RecordId"]): fingerprint(r) for r in records if r.get("RecordId") is not None}
+        stale = [(key, rid) for rid in old if new.get(rid) != old[rid]]
+        conn.executemany("DELETE FROM payloads WHERE key = ? AND record_id = ?", stale)
+        conn.execute("UPDATE runs SET records = ?, updated_at = ? WHERE key = ?", (_pack(records), time.time(), key))
+        conn.commit()
+
+    def completed(self, key):
+        """RecordIds (as str) whose payloads are already stored."""
+        rows = self._conn().execute("SELECT record_id FROM payloads WHERE key = ?", (key,))
+        return {rid for rid, in rows}
+
+    def payloads(self, key, size=FLUSH_EVERY):
+        """Stored payloads, yielded as lists of at most `size`."""
+        cursor = self._conn().execute("SELECT payload FROM payloads WHERE key = ? ORDER BY rowid", (key,))
+        while rows := cursor.fetchmany(size):
+            yield [_unpack(blob) for blob, in rows]
+
+    def add(self, key, items):
+        """Store (record_id, payload) pairs fetched for the run."""
+        if not items:
+            return
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO payloads VALUES (?, ?, ?)",
+            [(key, str(rid), _pack(payload)) for rid, payload in items]
+        )
+        conn.execute("UPDATE runs SET updated_at = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+
+    def set_fails(self, key, fails):
+        """Record the RecordIds a later run should retry first."""
+        conn = self._conn()
+        conn.execute(
+            "UPDATE runs SET fails = ?, updated_at = ? WHERE key = ?",
+            (json.dumps([str(rid) for rid in fails]), time.time(), key)
+        )
+        conn.commit()
+
+    def writer(self, key):
+        return Writer(self, key)
+
+    def finish(self, key):
+        """Drop the checkpoint of a run that has everything it needs."""
+        conn = self._conn()
+        conn.execute("DELETE FROM payloads WHERE key = ?", (key,))
+        conn.execute("DELETE FROM runs WHERE key = ?", (key,))
+        conn.commit()
+
+    def expire(self):
+        conn = self._conn()
+        stale = [key for key, in conn.execute("SELECT key FROM runs WHERE created_at < ?", (time.time() - self.ttl,))]
+        for key in stale:
+            conn.execute("DELETE FROM payloads WHERE key = ?", (key,))
+            conn.execute("DELETE FROM runs WHERE key = ?", (key,))
+        conn.commit()
+
+def get_store():
+    """Process-wide CheckpointStore, or None when CORETAX_CHECKPOINTS=0."""
+    global _store
+    if not CHECKPOINTS_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CheckpointStore()
+    return _store
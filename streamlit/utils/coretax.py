@@ -0,0 +1,486 @@
+import time
+import calendar
+import functools
+import threading
+import os
+import heapq
+import http.cookiejar
+import pandas as pd
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import throttle
+
+BASE_URL = "https://coretaxdjp.pajak.go.id"
+MAX_RETRIES = 3
+MAX_WORKERS = 8        
+PAGE_SIZE = 1000        # rows per list page, fetched concurrently after the first
+FETCH_BACKEND = os.environ.get("CORETAX_FETCH_BACKEND", "thread")   # "thread" or "async"
+ASYNC_CONCURRENCY = int(os.environ.get("CORETAX_ASYNC_CONCURRENCY", 200))
+MAX_CONCURRENCY = int(os.environ.get("CORETAX_MAX_CONCURRENCY", 64))
+REQUEST_TIMEOUT = (10, 120)
+POOL_SIZE = MAX_CONCURRENCY   # keep-alive sockets kept per host, shared by all workers
+
+# Adaptive in-flight limits per request kind: (initial, maximum)
+CONCURRENCY_LIMITS = {
+    "view": (MAX_WORKERS, ASYNC_CONCURRENCY if FETCH_BACKEND == "async" else MAX_CONCURRENCY),
+    "download": (3, 16),
+    "lampiran": (MAX_WORKERS, 32),
+}
+
+DEFAULT_HEADERS = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
+    "Content-Type": "application/json",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36 OPR/128.0.0.0",
+}
+
+_session = None
+_session_lock = threading.Lock()
+_limiters = {}
+
+month_mapping = {
+    "January": "TD.00701",
+    "February": "TD.00702",
+    "March": "TD.00703",
+    "April": "TD.00704",
+    "May": "TD.00705",
+    "June": "TD.00706",
+    "July": "TD.00707",
+    "August": "TD.00708",
+    "September": "TD.00709",
+    "October": "TD.00710",
+    "November": "TD.00711",
+    "December": "TD.00712",
+}
+PERIOD_MONTHS = {code: i for i, code in enumerate(month_mapping.values(), start=1)}
+
+WHITELIST = [
+    "0014826788619000", #AJP
+    "0929849651606000", #ALAIKA
+    "0011081726607000", #AMB
+    "0017929589606000", #AP
+    "0266437581619000", #APA
+    "0613315589604000", #ASTA
+    "0025326661714000", #BARTIM
+    "0941727117424000", #BK
+    "0827914995722000", #BKA
+    "0017925165615000", #CM
+    "0638937201609000", #CSP
+    "0010001519052000", #DAI
+    "0022978084651000", #DMS
+    "0961882339624000", #DNX
+    "0813485547806000", #DY
+    "0023769375532000", #EMU
+    "0022978076651000", #FWD
+    "0012333423641000", #GB
+    "0742752595619000", #KA4
+    "0763620879604000", #LA
+    "0029267960926000", #LM
+    "0955176037605000", #LPL
+    "0028245173614000", #MSA
+    "0531867802606000", #ORC
+    "0961899739925000", #PF
+    "0712014273801000", #PLI
+    "0022119804629000", #PMX
+    "0031059744643000", #SAC
+    "0621792662656000", #SIP
+    "0011098050651000", #SKMS
+    "0014815146614000", #SST
+    "0530442896609000", #SYS
+    "0025628108641000", #TMP
+    "0769014697604000", #URD
+    ##########################
+    "3578210209810003", #YOHAN
+    "3578092407720001", #ANTON
+    "3578241110000001", #JASON
+    "5101042704880003", #EKO
+]
+
+ROLE_SPT_MAPPING = {
+    32: {
+        "role": "PPN",
+        "code": "VAT_VAT",
+        "search_key":"-",
+        "alt" : "PPN"
+    },
+    38: {
+        "role": "Unifikasi",
+        "code": "ICT_WT",
+        "search_key":"Bukti Potong PPh Unifikasi (BPPU)",
+        "alt" : "Unifikasi"
+    },
+    42: {
+        "role": "PPh21",
+        "code": "ICT_WIT",
+        "search_key":"Bukti Potong PPh Pasal 21",
+        "alt" : "A1 / BP21"
+    }
+}
+
+def get_session():
+    """
+    Process-wide pooled HTTP session for every Coretax call.
+    One keep-alive connection pool of POOL_SIZE sockets is shared by all
+    worker threads, so TLS handshakes are paid once per socket instead of
+    once per request. Failed connection attempts are retried by the adapter.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Only connection-level failures are retried here; HTTP
+                # status retries are scheduled per record by the callers.
+                retry = Retry(
+                    total=3,
+                    connect=3,
+                    read=0,
+                    status=0,
+                    backoff_factor=0.5,
+                    allowed_methods=frozenset({"GET", "POST"}),
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=POOL_SIZE,
+                    pool_block=False,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.headers.update(DEFAULT_HEADERS)
+                # Shared by every user's token: never store a cookie Coretax
+                # (or its load balancer) sets, or it would be replayed for others
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def get_limiter(kind):
+    """
+    Process-wide AIMD concurrency controller for one kind of request
+    ("view", "download", "lampiran"), see utils.throttle.
+    """
+    if kind not in _limiters:
+        with _session_lock:
+            if kind not in _limiters:
+                initial, maximum = CONCURRENCY_LIMITS[kind]
+                _limiters[kind] = throttle.AdaptiveLimiter(initial, maximum=maximum)
+    return _limiters[kind]
+
+def post(url, headers=None, json=None, timeout=REQUEST_TIMEOUT, limiter=None, **kwargs):
+    """
+    POST through the shared session with the default Coretax timeout.
+    With a limiter, wait for an in-flight slot first and report the
+    latency and outcome back so it can adapt.
+    """
+    if limiter is None:
+        return get_session().post(url, headers=headers, json=json, timeout=timeout, **kwargs)
+
+    limiter.acquire()
+    started = time.monotonic()
+    try:
+        resp = get_session().post(url, headers=headers, json=json, timeout=timeout, **kwargs)
+    except Exception as e:
+        limiter.release(time.monotonic() - started, throttle.classify(exc=e))
+        raise
+    limiter.release(time.monotonic() - started, throttle.classify(resp.status_code))
+    return resp
+
+def auth_headers(token):
+    """Headers of every authorized Coretax API call."""
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+
+def keepalive(token):
+    """
+    Ping the Coretax KeepAlive endpoint to maintain the session and return
+    the HTTP status (200 when it was accepted). Connection errors are raised.
+    """
+    url = BASE_URL + "/identityproviderportal/api/Account/SessionKeepAlive"
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Referer":"https://coretaxdjp.pajak.go.id/registration-portal/id-ID/my-profile",
+        "Request_from":"https://coretaxdjp.pajak.go.id/registration-portal/id-ID/my-profile"
+    }
+    resp = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    return resp.status_code
+
+def format_date(date_str):
+    """Convert ISO date string (2025-09-17T00:00:00) to YYYY/MM/DD format."""
+    try:
+        return pd.to_datetime(date_str).strftime("%Y/%m/%d")
+    except Exception:
+        return ""
+    
+@functools.lru_cache(maxsize=None)
+def get_period_end_date(period_code, year):
+    """
+    Map Coretax TD.007XX period codes to the end-of-month date.
+    Example: TD.00709 + 2025 → 2025/09/30, TD.00702 + 2024 → 2024/02/29
+    """
+    if not period_code:
+        return ""
+    month = PERIOD_MONTHS.get(period_code[:8])  # first 8 chars e.g. TD.00709
+    if month is None:
+        return ""
+    try:
+        last_day = calendar.monthrange(int(year), month)[1]
+    except (TypeError, ValueError):
+        # No usable year: fall back to the non-leap month end, as before
+        return f"/{month:02d}/{calendar.monthrange(2001, month)[1]:02d}"
+    return f"{year}/{month:02d}/{last_day:02d}"
+    
+def reverse_month_mapping(period):
+    reverse_map = {v: k for k, v in month_mapping.items()}
+    return reverse_map.get(period, "")
+
+def get_allowed_roles(code):
+    order = [32, 38, 42]
+
+    if not code:
+        return {}
+
+    # Ensure code is exactly 3 chars (pad if needed)
+    code = str(code).zfill(3)
+
+    allowed_roles = {}
+    for digit, role in zip(code, order):
+        if digit == "1":
+            entry = ROLE_SPT_MAPPING[role]
+            allowed_roles[entry["role"]] = entry
+
+    return allowed_roles
+    
+def fetch_list(url, headers, payload, page_size=PAGE_SIZE, max_workers=MAX_WORKERS, key="RecordId"):
+    """
+    Fetch every page of a Coretax list endpoint.
+    The first page tells us Payload.TotalRecords, the remaining First
+    offsets are then requested concurrently and merged in order.
+    Records are de-duplicated on `key` (pass None to keep everything).
+    """
+    def fetch_page(first):
+        body = {**payload, "First": first, "Rows": page_size}
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                resp = post(url, headers=headers, json=body)
+                resp.raise_for_status()
+                return resp.json().get("Payload", {}) or {}
+            except requests.exceptions.RequestException as e:
+                if attempt == MAX_RETRIES or not throttle.is_retryable(e):
+                    raise
+                time.sleep(throttle.retry_delay(attempt, e))
+
+    first_page = fetch_page(0)
+    records = list(first_page.get("Data", []) or [])
+    total = first_page.get("TotalRecords")
+
+    if total is None:
+        # No total reported: walk pages until a short one comes back
+        first = page_size
+        while len(records) == first:
+            records.extend(fetch_page(first).get("Data", []) or [])
+            first += page_size
+    else:
+        offsets = list(range(page_size, int(total), page_size))
+        if offsets:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(offsets))) as executor:
+                for page in executor.map(fetch_page, offsets):
+                    records.extend(page.get("Data", []) or [])
+
+    if key is None:
+        return records
+
+    seen = set()
+    unique = []
+    for r in records:
+        rid = r.get(key)
+        if rid is not None:
+            if rid in seen:
+                continue
+            seen.add(rid)
+        unique.append(r)
+    return unique
+
+def detail_payload(rid, url, taxpayer_id):
+    """Request body for an einvoiceportal `view` call."""
+    if "output" in url:
+        return {
+            "RecordIdentifier": rid,
+            "EinvoiceVATStatus": "VAT_VAT",
+            "TaxpayerAggregateIdentifier": taxpayer_id
+        }
+    return {
+        "RecordIdentifier": rid,
+        "EinvoiceVATStatus": "",
+        "TaxpayerAggregateIdentifier": taxpayer_id
+    }
+
+def fetch_one(rid, url, headers, token, taxpayer_id):
+    payload = detail_payload(rid, url, taxpayer_id)
+    resp = post(url, headers=headers, json=payload, limiter=get_limiter("view"))
+    resp.raise_for_status()
+    return resp.json().get("Payload", {})
+
+def run_with_retries(keys, submit, on_progress=None, on_result=None, on_fail=None):
+    """
+    Run submit(key) -> concurrent Future for every key and collect results.
+    Retryable failures (see throttle.is_retryable) wait on a delay heap for a
+    jittered backoff or the server's Retry-After and are then resubmitted,
+    up to MAX_RETRIES attempts per key, without holding up the rest.
+    Everything else goes straight to `fails`.
+    Returns ({key: result}, fails). on_progress(done, total, waiting) is
+    called on the calling thread after every completion, on_result(key,
+    result) as each result comes in and on_fail(key, exc) with the last
+    exception of every key that ends up in `fails`.
+    """
+    total = len(keys)
+    results = {}
+    fails = []
+    # future -> (key, attempt)
+    pending = {submit(key): (key, 1) for key in keys}
+    delayed = []
+    seq = 0
+
+    while pending or delayed:
+        now = time.monotonic()
+        while delayed and delayed[0][0] <= now:
+            _, _, key, attempt = heapq.heappop(delayed)
+            pending[submit(key)] = (key, attempt)
+
+        timeout = max(0, delayed[0][0] - now) if delayed else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            key, attempt = pending.pop(future)
+            try:
+                results[key] = future.result()
+                if on_result is not None:
+                    on_result(key, results[key])
+            except Exception as e:
+                if attempt < MAX_RETRIES and throttle.is_retryable(e):
+                    ready = time.monotonic() + throttle.retry_delay(attempt, e)
+                    seq += 1
+                    heapq.heappush(delayed, (ready, seq, key, attempt + 1))
+                else:
+                    fails.append(key)
+                    if on_fail is not None:
+                        on_fail(key, e)
+
+        if on_progress is not None:
+            on_progress(len(results), total, len(delayed))
+
+    return results, fails
+
+def fetch_chunk_parallel(
+    record_ids,
+    url,
+    headers,
+    token,
+    taxpayer_id,
+    on_progress=None,
+    max_workers=None,
+    backend=None,
+    cache=None,
+    on_result=None,
+    fingerprints=None,
+    on_fail=None
+):
+    """
+    Fetch `view` payloads for record_ids concurrently.
+    backend "thread" uses a ThreadPoolExecutor, "async" hands the requests
+    to the shared asyncio loop in utils.aio. Either way the number of
+    requests actually in flight is set by the "view" AdaptiveLimiter;
+    max_workers only caps the thread pool (defaults to the limiter maximum).
+    Both yield concurrent futures, so run_with_retries handles progress,
+    retries and failures the same for either; on_progress(done, total,
+    waiting), on_result(record_id, payload) and on_fail(record_id, exc)
+    are passed through to it.
+    Successful payloads are written through to `cache` (a DetailCache),
+    tagged with their list record's fingerprint from `fingerprints`.
+    """
+    backend = backend or FETCH_BACKEND
+    limiter = get_limiter("view")
+    max_workers = max_workers or limiter.maximum
+
+    if backend == "async":
+        from . import aio
+        executor = None
+        submit = lambda rid: aio.submit_fetch(rid, url, headers, taxpayer_id)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        submit = lambda rid: executor.submit(fetch_one, rid, url, headers, token, taxpayer_id)
+
+    results = {}
+    try:
+        results, fails = run_with_retries(record_ids, submit, on_progress, on_result, on_fail)
+    finally:
+        if executor is not None:
+            # nothing is left queued unless run_with_retries was interrupted
+            executor.shutdown(wait=True, cancel_futures=True)
+        if cache is not None:
+            cache.put_many(url, list(results.items()), taxpayer_id, fingerprints)
+
+    return list(results.values()), fails
+
+def fetch_grid(url, headers, payload):
+    """One lampiran grid request; '' when Coretax answers with an empty body."""
+    resp = post(url, headers=headers, json=payload, limiter=get_limiter("lampiran"))
+    resp.raise_for_status()
+    data = resp.json()
+    if len(data) == 0:
+        return ''
+    return data.get("Payload", data)
+
+def fetch_grids(requests_by_key, headers, on_progress=None, page_size=PAGE_SIZE):
+    """
+    Fetch lampiran grids concurrently, every page of them.
+    requests_by_key maps a key such as (record_id, api_url) to (url, payload).
+    The first page of every grid is fetched in one fan-out; grids whose
+    TotalRecords exceeds page_size then have their remaining First offsets
+    fetched in a second fan-out and merged back in order.
+    Returns ({key: grid payload}, failed keys), keyed rather than positional
+    so one failed grid cannot shift the others. A grid with any failed page
+    counts as failed rather than coming back truncated.
+    """
+    limiter = get_limiter("lampiran")
+
+    with ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+        def submit(page_key):
+            key, first = page_key
+            url, payload = requests_by_key[key]
+            body = {**payload, "First": first, "Rows": page_size}
+            return executor.submit(fetch_grid, url, headers, body)
+
+        first_pages, fails = run_with_retries(
+            [(key, 0) for key in requests_by_key], submit, on_progress
+        )
+        more = [
+            (key, first)
+            for (key, _), page in first_pages.items() if isinstance(page, dict)
+            for first in range(page_size, int(page.get("TotalRecords") or 0), page_size)
+        ]
+        rest, rest_fails = run_with_retries(more, submit, on_progress) if more else ({}, [])
+
+    failed = []
+    for key, _ in fails + rest_fails:
+        if key not in failed:
+            failed.append(key)
+
+    grids = {}
+    for (key, _), page in first_pages.items():
+        if key in failed:
+            continue
+        if isinstance(page, dict):
+            data = list(page.get("Data") or [])
+            for first in range(page_size, int(page.get("TotalRecords") or 0), page_size):
+                more_page = rest[(key, first)]
+                # '' from fetch_grid when the grid shrank since its first page
+                if isinstance(more_page, dict):
+                    data.extend(more_page.get("Data") or [])
+            page = {**page, "Data": data}
+        grids[key] = page
+    return grids, failed
@@ -0,0 +1,102 @@
+import base64
+import json
+import os
+import re
+from itertools import chain
+
+CHUNK_SIZE = 64 * 1024
+MAX_PDF_BYTES = float(os.environ.get("CORETAX_MAX_PDF_MB", 50)) * 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+
+_VALUE_START = re.compile(rb'\s*:\s*("|null)')
+
+def decode_base64_field(chunks, out, field="Content"):
+    """
+    Decode the base64 string `field` of a JSON body that arrives as byte
+    chunks (e.g. resp.iter_content()) straight into the binary file-like
+    `out`, a few KB at a time, so neither the JSON text nor the base64
+    string is ever held whole. JSON escapes inside the string (\\/, \\u002B)
+    are undone on the way. Returns the number of bytes written; 0 when the
+    field is missing or null.
+    """
+    marker = b'"' + field.encode("ascii") + b'"'
+    chunks = iter(chunks)
+    buf = b""
+    start = None
+
+    # Find where the string value begins
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            i = buf.find(marker)
+            if i == -1:
+                buf = buf[-len(marker):]
+                break
+            start = _VALUE_START.match(buf, i + len(marker))
+            if start is not None:
+                break
+            tail = buf[i + len(marker):]
+            if len(tail) < 16 and not tail.strip(b" \t\r\n:nul"):
+                buf = buf[i:]           # rest of `"Content": "` not here yet
+                break
+            buf = buf[i + 1:]           # "Content" was a value, not the key
+        if start is not None:
+            break
+
+    if start is None or start.group(1) == b"null":
+        return 0
+
+    written = 0
+    carry = ""      # < 4 base64 chars, or an escape split across chunks
+    for chunk in chain([buf[start.end():]], chunks):
+        end = chunk.find(b'"')
+        text = carry + (chunk if end == -1 else chunk[:end]).decode("ascii")
+
+        hold = ""
+        if end == -1:
+            j = text.rfind("\\")
+            if j != -1 and len(text) - j < (6 if text[j + 1:j + 2] == "u" else 2):
+                text, hold = text[:j], text[j:]
+        if "\\" in text:
+            text = json.loads('"' + text + '"')
+
+        usable = len(text) if end != -1 else len(text) - len(text) % 4
+        if usable:
+            data = base64.b64decode(text[:usable])
+            out.write(data)
+            written += len(data)
+        carry = text[usable:] + hold
+
+        if end != -1:
+            return written
+
+    raise ValueError(f"Response ended inside the {field} string")
+
+def save_pdf(chunks, path, max_bytes=MAX_PDF_BYTES):
+    """
+    Stream a PDF response body (byte chunks) into `path`, checking as the
+    bytes arrive that it starts with %PDF- and stays under `max_bytes`.
+    A body that fails either check, or breaks off mid-way, raises and
+    leaves no partial file behind. Returns the size written.
+    """
+    size = 0
+    head = b""
+    try:
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                if len(head) < len(PDF_MAGIC):
+                    head += chunk[:len(PDF_MAGIC) - len(head)]
+                    if not PDF_MAGIC.startswith(head[:len(PDF_MAGIC)]):
+                        raise ValueError(f"Not a PDF (starts with {head!r})")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"PDF larger than {max_bytes / 1024 / 1024:.0f} MB")
+                f.write(chunk)
+        if not size:
+            raise ValueError("Empty PDF content")
+        if head != PDF_MAGIC:
+            raise ValueError(f"Not a PDF (starts with {head!r})")
+    except BaseException:
+        os.unlink(path)
+        raise
+    return size
@@ -0,0 +1,360 @@
+import math
+import numbers
+import os
+import tempfile
+import zipfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+EXCEL_MAX_ROWS = 1_048_576      # per sheet, header row included
+SHEET_ROWS = EXCEL_MAX_ROWS - 1
+EXCEL_MAX_CHARS = 32_767        # per cell
+WRITE_CHUNK = 20_000            # rows encoded at a time, bounds memory
+XLSX_DEFLATE_LEVEL = 1          # sheet XML is very repetitive, level 1 already shrinks it ~10x
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Download formats offered by the pages: label → (file extension, mime type)
+FORMATS = {
+    "Excel": ("xlsx", XLSX_MIME),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "CSV": ("csv", "text/csv"),
+    "TSV": ("tsv", "text/tab-separated-values"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Arrow IPC": ("arrow", "application/vnd.apache.arrow.file"),
+}
+CSV_DELIMITERS = {"CSV": ",", "TSV": "\t", "CSV (gzip)": ","}
+
+_EPOCH = pd.Timestamp("1899-12-30")     # Excel day 0 (1900 date system)
+_DATE_STYLE = 1                         # cellXfs index of the yyyy/mm/dd format in _STYLES
+_HEADER_STYLE = 2                       # cellXfs index of the bold header
+
+# XML escapes, and control characters that are not allowed in XML at all
+_ESCAPE = {ord("&"): "&amp;", ord("<"): "&lt;", ord(">"): "&gt;", ord('"'): "&quot;"}
+_ESCAPE.update({i: None for i in range(32) if i not in (9, 10, 13)})
+_SHEET_NAME = str.maketrans({c: "_" for c in "[]:*?/\\"})
+
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_HEAD = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+_STYLES = (
+    f'{_XML_HEAD}<styleSheet xmlns="{_MAIN_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy/mm/dd"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+def _temp_path(suffix, dir=None):
+    handle = tempfile.NamedTemporaryFile(suffix=suffix, dir=dir, delete=False)
+    handle.close()
+    return handle.name
+
+def _open_and_unlink(path):
+    # Same hand-over as archive.ZipSink.finish: the file vanishes once the handle is closed
+    handle = open(path, "rb")
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    return handle
+
+def _cell(value, style=""):
+    """One <c> element for a Python value; blanks still emit <c/> so later cells keep their column."""
+    if value is None:
+        return "<c/>"
+    if isinstance(value, str):
+        if not value:
+            return "<c/>"
+        text = value[:EXCEL_MAX_CHARS].translate(_ESCAPE)
+        return f'<c{style} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+    if isinstance(value, bool):
+        return f'<c{style} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Integral):
+        return f"<c{style}><v>{int(value)}</v></c>"
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        return f"<c{style}><v>{value!r}</v></c>" if math.isfinite(value) else "<c/>"
+    if value != value:      # NaT, pd.NA
+        return "<c/>"
+    return _cell(str(value), style)
+
+def _naive_date(value):
+    try:
+        parsed = pd.to_datetime(value, errors="coerce")
+    except (TypeError, ValueError):
+        return pd.NaT
+    if parsed is None or parsed is pd.NaT:
+        return pd.NaT
+    return parsed.tz_localize(None) if parsed.tzinfo is not None else parsed
+
+def _parse_dates(series):
+    """
+    Parse a column to naive datetimes, NaT where a value does not parse.
+    Zoned values keep their wall-clock time. pd.to_datetime refuses a
+    column mixing UTC offsets, so that one is parsed value by value.
+    """
+    try:
+        parsed = pd.to_datetime(series, errors="coerce")
+    except (TypeError, ValueError):
+        parsed = None
+    if parsed is None or not pd.api.types.is_datetime64_any_dtype(parsed):
+        parsed = pd.to_datetime(series.map(_naive_date))
+    if parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_localize(None)
+    return parsed
+
+def _column_cells(series, as_date=False):
+    """Encode a whole column to <c> elements, numbers and dates without per-cell type checks."""
+    if as_date or pd.api.types.is_datetime64_any_dtype(series):
+        try:
+            parsed = _parse_dates(series)
+            serials = ((parsed - _EPOCH) / pd.Timedelta(days=1)).tolist()
+        except (TypeError, ValueError):
+            serials = [math.nan] * len(series)
+        # Values that do not parse keep their original content
+        return [
+            f'<c s="{_DATE_STYLE}"><v>{serial!r}</v></c>' if serial == serial else _cell(value)
+            for serial, value in zip(serials, series.tolist())
+        ]
+
+    if pd.api.types.is_integer_dtype(series) and not series.hasnans:
+        return [f"<c><v>{v}</v></c>" for v in series.tolist()]
+    if pd.api.types.is_float_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return [
+            f"<c><v>{v!r}</v></c>" if math.isfinite(v) else "<c/>"
+            for v in series.to_numpy(dtype=float, na_value=math.nan).tolist()
+        ]
+
+    return [_cell(v) for v in series.tolist()]
+
+def _sheet_names(name, parts):
+    name = str(name).translate(_SHEET_NAME)[:31] or "Sheet"
+    names = [name]
+    for n in range(2, parts + 1):
+        suffix = f" ({n})"
+        names.append(name[:31 - len(suffix)] + suffix)
+    return names
+
+def _write_sheet(archive, part_name, df, header, as_date, first, last):
+    with archive.open(part_name, "w", force_zip64=True) as f:
+        f.write(f'{_XML_HEAD}<worksheet xmlns="{_MAIN_NS}"><sheetData>'.encode("utf-8"))
+        header_cells = "".join(_cell(h, f' s="{_HEADER_STYLE}"') for h in header)
+        f.write(f'<row r="1">{header_cells}</row>'.encode("utf-8"))
+
+        for start in range(first, last, WRITE_CHUNK):
+            chunk = df.iloc[start:min(start + WRITE_CHUNK, last)]
+            columns = [
+                _column_cells(chunk.iloc[:, i], as_date[i])
+                for i in range(len(header))
+            ]
+            rows = [
+                f'<row r="{r}">{"".join(cells)}</row>'
+                for r, cells in enumerate(zip(*columns), start=start - first + 2)
+            ]
+            f.write("".join(rows).encode("utf-8"))
+
+        f.write(b"</sheetData></worksheet>")
+
+def write_xlsx(sheets, date_columns=(), dir=None):
+    """
+    Write {sheet name: DataFrame} to an .xlsx temp file and return it opened
+    for reading, ready for st.download_button.
+    Sheet XML is streamed straight into the zip container WRITE_CHUNK rows
+    at a time, whole columns encoded at once, so memory stays flat and a
+    300k-row year exports in seconds. Numbers stay numeric cells,
+    `date_columns` (and datetime columns) become real Excel dates wherever
+    they parse, and a frame longer than one sheet allows continues on
+    "Name (2)", "Name (3)", ...
+    """
+    if not sheets:
+        raise ValueError("Nothing to export: no sheets")
+    path = _temp_path(".xlsx", dir)
+
+    try:
+        sheet_names = []
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=XLSX_DEFLATE_LEVEL) as archive:
+            for name, df in sheets.items():
+                header = [str(c) for c in df.columns]
+                as_date = [c in date_columns for c in df.columns]
+                parts = max(1, -(-len(df) // SHEET_ROWS))
+
+                for part, sheet_name in enumerate(_sheet_names(name, parts)):
+                    sheet_names.append(sheet_name)
+                    first = part * SHEET_ROWS
+                    last = min(first + SHEET_ROWS, len(df))
+                    _write_sheet(
+                        archive,
+                        f"xl/worksheets/sheet{len(sheet_names)}.xml",
+                        df, header, as_date, first, last
+                    )
+
+            count = len(sheet_names)
+            archive.writestr("[Content_Types].xml", (
+                f'{_XML_HEAD}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                '<Override PartName="/xl/styles.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                + "".join(
+                    f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                    for i in range(1, count + 1)
+                )
+                + "</Types>"
+            ))
+            archive.writestr("_rels/.rels", (
+                f'{_XML_HEAD}<Relationships xmlns="{_PKG_REL_NS}">'
+                f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+                "</Relationships>"
+            ))
+            archive.writestr("xl/workbook.xml", (
+                f'{_XML_HEAD}<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><sheets>'
+                + "".join(
+                    f'<sheet name="{sheet_name.translate(_ESCAPE)}" sheetId="{i}" r:id="rId{i}"/>'
+                    for i, sheet_name in enumerate(sheet_names, start=1)
+                )
+                + "</sheets></workbook>"
+            ))
+            archive.writestr("xl/_rels/workbook.xml.rels", (
+                f'{_XML_HEAD}<Relationships xmlns="{_PKG_REL_NS}">'
+                + "".join(
+                    f'<Relationship Id="rId{i}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                    for i in range(1, count + 1)
+                )
+                + f'<Relationship Id="rId{count + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+                "</Relationships>"
+            ))
+            archive.writestr("xl/styles.xml", _STYLES)
+    except BaseException:
+        os.unlink(path)
+        raise
+
+    return _open_and_unlink(path)
+
+def _arrow_column(series, type):
+    """One column coerced to `type`; empty strings and unparseable values become nulls."""
+    if pd.api.types.is_string_dtype(series):
+        series = series.astype(object).where(series != "", None)
+    if pa.types.is_date(type) or pa.types.is_timestamp(type):
+        return pa.array(_parse_dates(series), from_pandas=True).cast(type)
+    if pa.types.is_integer(type):
+        return pa.array(pd.to_numeric(series, errors="coerce").astype("Int64"), from_pandas=True).cast(type)
+    if pa.types.is_floating(type):
+        return pa.array(pd.to_numeric(series, errors="coerce"), type=type, from_pandas=True)
+    values = series.astype(object).where(series.notna(), None).tolist()
+    return pa.array([v if v is None or isinstance(v, str) else str(v) for v in values], type=type)
+
+def to_arrow(df, schema=None):
+    """
+    DataFrame → pyarrow Table. With a schema the table has exactly its
+    columns, in order and type, whatever the frame holds: missing columns
+    are all-null, extra ones are dropped.
+    """
+    if schema is None:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    empty = pd.Series([None] * len(df), index=df.index, dtype=object)
+    return pa.Table.from_arrays(
+        [_arrow_column(df[f.name] if f.name in df.columns else empty, f.type) for f in schema],
+        schema=schema
+    )
+
+def _write_frame(df, schema, fmt, path):
+    """
+    Write `df` as `fmt` to `path` WRITE_CHUNK rows at a time with pyarrow's
+    incremental writers, so only one chunk is ever held as Arrow data and
+    the file grows on disk however many rows there are.
+    """
+    fixed = schema is not None
+    if not fixed:
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+
+    def chunks():
+        for start in range(0, len(df), WRITE_CHUNK):
+            chunk = df.iloc[start:start + WRITE_CHUNK]
+            if fixed:
+                yield to_arrow(chunk, schema)
+            else:
+                yield pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+    if fmt == "Parquet":
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for table in chunks():
+                writer.write_table(table)
+    elif fmt == "Arrow IPC":
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for table in chunks():
+                writer.write_table(table)
+    elif fmt in CSV_DELIMITERS:
+        options = pa_csv.WriteOptions(delimiter=CSV_DELIMITERS[fmt])
+        sink = pa.CompressedOutputStream(path, "gzip") if fmt == "CSV (gzip)" else pa.OSFile(path, "wb")
+        with sink, pa_csv.CSVWriter(sink, schema, write_options=options) as writer:
+            for table in chunks():
+                writer.write_table(table)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+def file_type(fmt, sheets):
+    """(file extension, mime type) that write(fmt, sheets) comes back with."""
+    ext, mime = FORMATS[fmt]
+    if fmt != "Excel" and len(sheets) > 1:
+        return f"{ext}.zip", "application/zip"
+    return ext, mime
+
+def write(fmt, sheets, schemas=None, date_columns=(), dir=None):
+    """
+    Export {sheet name: DataFrame} as one of FORMATS and return
+    (open file, file extension, mime type) for st.download_button.
+    Excel keeps every sheet in one workbook (see write_xlsx). The other
+    formats hold one table per file: each sheet is converted with its
+    schema from `schemas` (see to_arrow) so the layout never depends on
+    the data, and several sheets come back as a zip with one file each.
+    Those files are written chunk by chunk (see _write_frame) and handed
+    over as open temp files, so writing one never builds it up in memory.
+    Serving it does: st.download_button reads the whole file into
+    Streamlit's in-memory media store, so pages pass it as deferred data
+    (see base.export_buttons) and only a clicked file is ever held.
+    """
+    ext, mime = FORMATS[fmt]
+    if fmt == "Excel":
+        return write_xlsx(sheets, date_columns=date_columns, dir=dir), ext, mime
+    if not sheets:
+        raise ValueError("Nothing to export: no sheets")
+
+    schemas = schemas or {}
+    paths = []
+    try:
+        for name, df in sheets.items():
+            paths.append(_temp_path("." + ext, dir))
+            _write_frame(df, schemas.get(name), fmt, paths[-1])
+
+        if len(paths) == 1:
+            return _open_and_unlink(paths.pop()), ext, mime
+
+        bundle = _temp_path(".zip", dir)
+        paths.append(bundle)
+        # Parquet / Arrow / gzip are compressed already, plain text is not
+        compression = zipfile.ZIP_DEFLATED if fmt in ("CSV", "TSV") else zipfile.ZIP_STORED
+        with zipfile.ZipFile(bundle, "w", compression, compresslevel=XLSX_DEFLATE_LEVEL) as archive:
+            for name, path in zip(sheets, paths):
+                archive.write(path, f"{name}.{ext}")
+        return _open_and_unlink(paths.pop()), f"{ext}.zip", "application/zip"
+    finally:
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
@@ -0,0 +1,605 @@
+import io
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from . import archive, checkpoint, coretax, flatten, heartbeat, throttle, download
+from . import cache as detail_cache
+from .parser import parse_lampiran
+
+VIEW_BATCH = 2000       # `view` payloads fetched, then projected to Arrow, at a time
+
+# Per e-invoice report: list / view endpoints, the list field that names
+# the taxpayer, how payloads flatten (see utils.flatten) and the export name
+INVOICE_REPORTS = {
+    "pajak_masukan": {
+        "list": "/einvoiceportal/api/inputinvoice/list",
+        "view": "/einvoiceportal/api/inputinvoice/view",
+        "party": "BuyerTaxpayerAggregateIdentifier",
+        "spec": flatten.INPUT_INVOICE,
+        "positive_only": False,
+        "file_name": "coretax_input_invoice_details",
+    },
+    "pajak_keluaran": {
+        "list": "/einvoiceportal/api/outputinvoice/list",
+        "view": "/einvoiceportal/api/outputinvoice/view",
+        "party": "SellerTaxpayerAggregateIdentifier",
+        "spec": flatten.OUTPUT_INVOICE,
+        "positive_only": False,
+        "file_name": "coretax_output_invoice_details",
+    },
+    "retur_masukan": {
+        "list": "/einvoiceportal/api/inputreturn/list",
+        "view": "/einvoiceportal/api/inputreturn/view",
+        "party": "BuyerTaxpayerAggregateIdentifier",
+        "spec": flatten.INPUT_RETURN,
+        "positive_only": True,
+        "file_name": "coretax_input_return_details",
+    },
+    "retur_keluaran": {
+        "list": "/einvoiceportal/api/outputreturn/list",
+        "view": "/einvoiceportal/api/outputreturn/view",
+        "party": "SellerTaxpayerAggregateIdentifier",
+        "spec": flatten.OUTPUT_RETURN,
+        "positive_only": True,
+        "file_name": "coretax_output_return_details",
+    },
+}
+
+# SPT by role name ("PPN", "Unifikasi", "PPh21"), see coretax.ROLE_SPT_MAPPING
+SPT_TYPES = {entry["role"]: entry for entry in coretax.ROLE_SPT_MAPPING.values()}
+
+# Lampiran grids per SPT, in the sheet order parse_lampiran expects
+LAMPIRAN_GRIDS = {
+    "PPN": [
+        "/returnsheetportal/api/loadndvat/la1-grid",
+        "/returnsheetportal/api/loadndvat/la2-grid",
+        "/returnsheetportal/api/loadndvat/lb1-grid",
+        "/returnsheetportal/api/loadndvat/lb2-grid",
+        "/returnsheetportal/api/loadndvat/lb3-grid",
+    ],
+    "PPh21": [
+        "/returnsheetportal/api/loadarticle2126/l1a-grid",
+        "/returnsheetportal/api/loadarticle2126/l1b-bpa1-grid",
+        "/returnsheetportal/api/loadarticle2126/l2-bpa1-grid",
+        "/returnsheetportal/api/loadarticle2126/l3-bp21-grid",
+    ],
+    "Unifikasi": [
+        "/returnsheetportal/api/loadwtr/list-i-bpu-grid",
+    ],
+}
+
+A1_LIST_URL = "/withholdingslipsportal/api/getebupotbpa1issued"
+A1_DOWNLOAD_URL = "/withholdingslipsportal/api/DownloadWithholdingSlips/download-pdf-document"
+A1_KEYS = {
+    "WithholdingslipsAggregateIdentifier",
+    "RecordId",
+    "DocumentFormAggregateIdentifier",
+    "LastUpdatedDate",
+    "TaxIdentificationNumber",
+    "Name",
+}
+
+BUPOT_LIST_URL = "/documentmanagementportal/api/list/listTaxpayerDocuments"
+BUPOT_DOWNLOAD_URL = "/documentmanagementportal/api/download"
+BUPOT_KEYS = {
+    "AggregateIdentifier",
+    "DocumentNumber",
+    "LetterNumber",
+}
+
+def _no_progress(stage, done, total):
+    pass
+
+def _filter(name, value, mode):
+    return {
+        "PropertyName": name,
+        "Value": value,
+        "MatchMode": mode,
+        "CaseSensitive": True,
+        "AsString": False
+    }
+
+def tax_period(month, year):
+    """Return sheet / bupot period code: month 9 of 2025 → 09092025"""
+    return f"{month:02d}{month:02d}{year}"
+
+# --- e-invoices (pajak masukan / keluaran, retur masukan / keluaran) ---
+
+def invoice_list_payload(report, taxpayer_id, period, year, status="APPROVED"):
+    """
+    Body of an e-invoice list request for one TD.007XX period.
+    Pajak masukan listed as CREDITED is filtered on the crediting period
+    (PeriodCredit / YearCredit) instead of the invoice period.
+    """
+    credited = report == "pajak_masukan" and status == "CREDITED"
+    return {
+        INVOICE_REPORTS[report]["party"]: f"{taxpayer_id}",
+        "First": 0,
+        "Rows": coretax.PAGE_SIZE,
+        "SortField": "",
+        "SortOrder": 1,
+        "Filters": [
+            _filter("PeriodCredit" if credited else "TaxInvoicePeriod", period, "contains"),
+            _filter("YearCredit" if credited else "TaxInvoiceYear", year, "equals"),
+            _filter("TaxInvoiceStatus", status, "equals"),
+        ],
+        "LanguageId": "id-ID",
+        "TaxpayerAggregateIdentifier": f"{taxpayer_id}"
+    }
+
+def fetch_invoice_batches(report, token, taxpayer_id, period, year, status="APPROVED", on_progress=None, use_cache=True, delta=False, resume=True):
+    """
+    List, view and project one e-invoice report for a period.
+    Payloads are fetched VIEW_BATCH at a time and projected straight
+    away, so only compact Arrow batches are kept, and written through to
+    the local detail cache. on_progress(stage, done, total) is called for
+    the "list" and "view" stages.
+    With `delta` only new or changed records are fetched: those whose
+    list fingerprint (detail_cache.fingerprint) matches the previous
+    run's manifest for the same query are read from the cache, which
+    keeps them past its TTL while a manifest refers to them. Without it
+    every record is fetched again and the manifest brought up to date.
+    With `resume` the run is checkpointed per taxpayer, report and period
+    (see utils.checkpoint): payloads are stored as they arrive, and a run
+    that was interrupted or left retryable failures is carried on from its
+    stored payloads, by any process, without refetching them. The list is
+    fetched again on resume, so records added since are picked up and
+    changed ones refetched. The checkpoint is dropped once every record
+    is in or has failed with a non-retryable error (e.g. a 404).
+    Returns (flatten.invoice_batch RecordBatches, RecordIds that could
+    not be fetched); see invoice_frame for the DataFrame.
+    """
+    on_progress = on_progress or _no_progress
+    spec = INVOICE_REPORTS[report]
+    headers = coretax.auth_headers(token)
+    store = checkpoint.get_store() if resume else None
+    key = checkpoint.run_key(taxpayer_id, report, period=period, year=year, status=status)
+    saved = store.load(key) if store is not None else None
+
+    records = coretax.fetch_list(
+        coretax.BASE_URL + spec["list"],
+        headers,
+        invoice_list_payload(report, taxpayer_id, period, year, status)
+    )
+    last_fails = []
+    if saved is not None:
+        # payloads of records that changed or were withdrawn are dropped
+        _, last_fails = saved
+        store.refresh(key, records)
+    elif store is not None:
+        store.start(key, records)
+    record_ids = [r["RecordId"] for r in records if r.get("RecordId") is not None]
+    total = len(record_ids)
+    on_progress("list", total, total)
+
+    url = coretax.BASE_URL + spec["view"]
+    cache = detail_cache.get_cache() if use_cache else None
+    batches = []
+    pending = record_ids
+    if saved is not None:
+        for payloads in store.payloads(key, VIEW_BATCH):
+            batches.append(flatten.invoice_batch(payloads, spec["spec"]))
+        completed = store.completed(key)
+        # last run's failures go first, as they did on the old retry click
+        retry = set(last_fails)
+        pending = sorted(
+            (rid for rid in record_ids if str(rid) not in completed),
+            key=lambda rid: str(rid) not in retry
+        )
+
+    # cached payloads are only reused for list records that have not changed
+    fingerprints = {
+        str(r["RecordId"]): detail_cache.fingerprint(r)
+        for r in records if r.get("RecordId") is not None
+    }
+    # the manifest is per query, shared by the pages, the CLI and batches
+    scope = {"report": report, "period": period, "year": str(year), "status": status}
+    if cache is not None and delta:
+        previous = cache.get_manifest(url, taxpayer_id, scope)
+        unchanged = [rid for rid in pending if previous.get(str(rid)) == fingerprints.get(str(rid))]
+        cached = cache.get_many(url, unchanged, taxpayer_id, ttl=float("inf"), fingerprints=fingerprints)
+        if cached:
+            batches.append(flatten.invoice_batch(list(cached.values()), spec["spec"]))
+            pending = [rid for rid in pending if str(rid) not in cached]
+
+    done = total - len(pending)
+    on_progress("view", done, total)
+    fails = []
+    retryable = set()
+    writer = store.writer(key) if store is not None else None
+
+    def on_fail(rid, e):
+        if throttle.is_retryable(e):
+            retryable.add(rid)
+
+    # the session is kept alive in the background while records are fetched
+    with heartbeat.hold(token):
+        try:
+            for start in range(0, len(pending), VIEW_BATCH):
+                payloads, batch_fails = coretax.fetch_chunk_parallel(
+                    pending[start:start + VIEW_BATCH],
+                    url,
+                    headers,
+                    token,
+                    taxpayer_id,
+                    on_progress=lambda n, _, waiting: on_progress("view", done + n, total),
+                    cache=cache,
+                    on_result=writer,
+                    fingerprints=fingerprints,
+                    on_fail=on_fail
+                )
+                if payloads:
+                    batches.append(flatten.invoice_batch(payloads, spec["spec"]))
+                fails.extend(batch_fails)
+                done += len(payloads)
+                on_progress("view", done, total)
+        finally:
+            # an interrupted run keeps whatever had already arrived
+            if writer is not None:
+                writer.flush()
+
+    if store is not None:
+        # a record Coretax refuses outright (4xx) would fail again on resume
+        retry = [rid for rid in fails if rid in retryable]
+        if retry:
+            store.set_fails(key, retry)
+        else:
+            store.finish(key)
+    if cache is not None:
+        failed = {str(rid) for rid in fails}
+        cache.save_manifest(
+            url, taxpayer_id, scope,
+            {rid: fp for rid, fp in fingerprints.items() if rid not in failed}
+        )
+    return batches, fails
+
+def invoice_frame(report, batches):
+    """DataFrame in flatten.COLUMNS layout, derived columns filled in, from fetch_invoice_batches output."""
+    df = flatten.to_frame(batches)
+    return flatten.derive_columns(df, positive_only=INVOICE_REPORTS[report]["positive_only"])
+
+def fetch_invoices(report, *args, **kwargs):
+    """fetch_invoice_batches, returning (invoice_frame DataFrame, RecordIds that could not be fetched)."""
+    batches, fails = fetch_invoice_batches(report, *args, **kwargs)
+    return invoice_frame(report, batches), fails
+
+# --- Lampiran SPT ---
+
+def lampiran_list_payload(spt, taxpayer_id, taxperiod):
+    """Body of the submitted return sheets request for one SPT and period code."""
+    return {
+        "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
+        "isArchieved": False,
+        "First": 0,
+        "Rows": coretax.PAGE_SIZE,
+        "SortField": "",
+        "SortOrder": 1,
+        "Filters": [
+            _filter("TaxTypeCode", [f"{SPT_TYPES[spt]['code']}"], "contains"),
+            _filter("TaxPeriodCode", f"{taxperiod}", "equals"),
+        ],
+        "LanguageId": "id-ID"
+    }
+
+def grid_payload(spt, record_id, taxpayer_id):
+    """Body of a lampiran grid request for one return sheet."""
+    payload = {
+        "ReturnSheetRecordId": f"{record_id}",
+        "First": 0,
+        "Rows": coretax.PAGE_SIZE,
+        "SortField": "",
+        "SortOrder": 1,
+        "Filters": [],
+        "LanguageId": "id-ID",
+        "TaxpayerAggregateIdentifier": f"{taxpayer_id}"
+    }
+    if spt == "PPN":
+        payload["IsNormalVAT"] = True
+    return payload
+
+def list_return_sheets(spt, token, taxpayer_id, taxperiod):
+    """RecordIds of the `spt` return sheets submitted for a period code."""
+    records = coretax.fetch_list(
+        coretax.BASE_URL + "/returnsheetportal/api/returnsheetssubmitted",
+        coretax.auth_headers(token),
+        lampiran_list_payload(spt, taxpayer_id, taxperiod)
+    )
+    return [r["RecordId"] for r in records if r.get("RecordId") is not None]
+
+def fetch_lampiran(spt, token, taxpayer_id, record_ids, on_progress=None):
+    """
+    Every lampiran grid of every return sheet in record_ids, see
+    coretax.fetch_grids. on_progress(stage, done, total) is called for the
+    "grids" stage, counting grid pages.
+    Returns ({(record_id, grid url): grid payload}, failed keys).
+    """
+    on_progress = on_progress or _no_progress
+    grid_requests = {
+        (rid, api_url): (coretax.BASE_URL + api_url, grid_payload(spt, rid, taxpayer_id))
+        for rid in record_ids
+        for api_url in LAMPIRAN_GRIDS[spt]
+    }
+    return coretax.fetch_grids(
+        grid_requests,
+        coretax.auth_headers(token),
+        on_progress=lambda done, total, waiting: on_progress("grids", done, total)
+    )
+
+def fetch_lampiran_sheets(spt, token, taxpayer_id, month, year, on_progress=None):
+    """
+    List the `spt` return sheets of a month and fetch and parse the
+    lampiran of the first one listed, the one lampiran_frames reads;
+    other revisions' grids are never requested. on_progress(stage, done,
+    total) is called for the "list" and "grids" stages.
+    Returns (RecordIds, lampiran_frames sheets, failed grid keys); no
+    sheets when nothing was submitted for the period.
+    """
+    on_progress = on_progress or _no_progress
+    record_ids = list_return_sheets(spt, token, taxpayer_id, tax_period(month, year))
+    on_progress("list", len(record_ids), len(record_ids))
+    if not record_ids:
+        return record_ids, {}, []
+
+    with heartbeat.hold(token):
+        grids, fails = fetch_lampiran(spt, token, taxpayer_id, record_ids[:1], on_progress)
+    dfs = lampiran_frames(spt, record_ids, grids, month) if grids else {}
+    return record_ids, dfs, fails
+
+def lampiran_frames(spt, record_ids, grids, masa):
+    """
+    parse_lampiran sheets of the first return sheet, each non-empty one
+    with the period month as a leading Masa column.
+    """
+    # parse_lampiran reads one grid per sheet, in LAMPIRAN_GRIDS order
+    details = [grids.get((record_ids[0], api_url), '') for api_url in LAMPIRAN_GRIDS[spt]]
+    dfs = parse_lampiran(spt, details)
+    for df in dfs.values():
+        if not df.empty:
+            df.insert(0, "Masa", masa)
+    return dfs
+
+# --- A1 / Bupot PDF downloads ---
+
+def _download(fetch, row):
+    """Run fetch(row) with the usual retries; result dict as the pages expect."""
+    for attempt in range(1, coretax.MAX_RETRIES + 1):
+        try:
+            fetch(row)
+            return {"success": True}
+        except Exception as e:
+            if attempt == coretax.MAX_RETRIES or not throttle.is_retryable(e):
+                return {
+                    "success": False,
+                    "row": row,
+                    "error": str(e),
+                }
+            time.sleep(throttle.retry_delay(attempt, e))
+
+def a1_list_payload(taxpayer_id, taxperiod):
+    """Body of the issued BPA1 list request for one IncomePeriodCodeEnd."""
+    return {
+        "First": 0,
+        "Rows": coretax.PAGE_SIZE,
+        "SortField": "",
+        "SortOrder": 1,
+        "Filters": [
+            _filter("IncomePeriodCodeEnd", f"{taxperiod}", "equals"),
+        ],
+        "LanguageId": "id-ID",
+        "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
+    }
+
+def download_a1(token, taxpayer_id, taxperiods, sink, on_progress=None, on_list_error=None):
+    """
+    List the BPA1 bupot issued for every period code in taxperiods and
+    download their PDFs into `sink` (an archive.ZipSink).
+    All period listings run at once; each listed bupot goes straight into
+    the download pool, so early months download while later ones still
+    list. on_progress(stage, done, total) reports "list" (periods listed)
+    and "download" (files done out of those listed so far);
+    on_list_error(taxperiod, exc) a period whose listing failed.
+    If the run breaks off, queued downloads are cancelled before the
+    error is raised. Returns the rows whose PDF could not be downloaded.
+    """
+    on_progress = on_progress or _no_progress
+    headers = coretax.auth_headers(token)
+    limiter = coretax.get_limiter("download")
+    url = coretax.BASE_URL + A1_DOWNLOAD_URL
+
+    def fetch_pdf(row):
+        payload = {
+            "WithholdingSlipsAggregateIdentifier": row["WithholdingslipsAggregateIdentifier"],
+            "WithholdingSlipsRecordIdentifier": row["RecordId"],
+            "DocumentAggregateIdentifier": row["DocumentFormAggregateIdentifier"],
+            "TaxpayerAggregateIdentifier": taxpayer_id,
+            "EbupotType": "EBUPOTBPA1",
+            "DocumentDate": row["LastUpdatedDate"],
+            "TaxIdentificationNumber": row["TaxIdentificationNumber"],
+        }
+        # Decode the base64 Content while it streams in, so only the
+        # PDF bytes are ever held, then hand them to the zip writer
+        pdf = io.BytesIO()
+        with coretax.post(url, headers=headers, json=payload, limiter=limiter, stream=True) as resp:
+            resp.raise_for_status()
+            size = download.decode_base64_field(resp.iter_content(download.CHUNK_SIZE), pdf)
+
+        if not size:
+            raise ValueError("Empty PDF content")
+
+        sink.add(f"{row['Name']}.pdf", pdf.getbuffer())
+
+    fails = []
+    listed = 0
+    completed = 0
+    periods_done = 0
+
+    list_executor = ThreadPoolExecutor(max_workers=max(1, len(taxperiods)))
+    executor = ThreadPoolExecutor(max_workers=limiter.maximum)
+    try:
+        with heartbeat.hold(token):
+            pending = {
+                list_executor.submit(
+                    coretax.fetch_list, coretax.BASE_URL + A1_LIST_URL, headers, a1_list_payload(taxpayer_id, taxperiod)
+                ): ("list", taxperiod)
+                for taxperiod in taxperiods
+            }
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, item = pending.pop(future)
+
+                    if kind == "list":
+                        periods_done += 1
+                        try:
+                            records = future.result()
+                        except requests.exceptions.RequestException as e:
+                            if on_list_error is not None:
+                                on_list_error(item, e)
+                            continue
+                        for r in records:
+                            row = {k: r.get(k) for k in A1_KEYS}
+                            pending[executor.submit(_download, fetch_pdf, row)] = ("pdf", row)
+                        listed += len(records)
+                        continue
+
+                    result = future.result()
+                    completed += 1
+                    if not result["success"]:
+                        fails.append(result["row"])
+
+                on_progress("list", periods_done, len(taxperiods))
+                on_progress("download", completed, listed)
+    finally:
+        # if the run breaks off, queued listings and downloads are dropped
+        # instead of drained
+        list_executor.shutdown(wait=True, cancel_futures=True)
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return fails
+
+def bupot_list_payload(taxpayer_id, search_key, start, end):
+    """Body of the Dokumen Saya list request: titles starting with search_key, dated start..end."""
+    return {
+        "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
+        "IsCaseCompleted": True,
+        "IsSkipInvoiceDocument": False,
+        "First": 0,
+        "Rows": coretax.PAGE_SIZE,
+        "SortField": "CreationDatetime",
+        "SortOrder": 1,
+        "Filters": [
+            _filter("DocumentDate", [start.strftime("%Y/%m/%d"), end.strftime("%Y/%m/%d")], "between"),
+            {**_filter("DocumentTitle", f"{search_key}", "startsWith"), "CaseSensitive": False},
+        ],
+        "LanguageId": "id-ID"
+    }
+
+def list_bupot(token, taxpayer_id, search_key, start, end):
+    """Dokumen Saya rows (BUPOT_KEYS only) for bupot titled search_key, dated start..end."""
+    records = coretax.fetch_list(
+        coretax.BASE_URL + BUPOT_LIST_URL,
+        coretax.auth_headers(token),
+        bupot_list_payload(taxpayer_id, search_key, start, end)
+    )
+    return [{k: r.get(k) for k in BUPOT_KEYS} for r in records]
+
+def download_bupot(token, taxpayer_id, rows, sink, on_progress=None):
+    """
+    Download the list_bupot() rows' PDFs into `sink` (an archive.ZipSink),
+    each streamed to the archive's staging dir and checked as it arrives.
+    on_progress(stage, done, total) reports the "download" stage. If the
+    run breaks off, the pool is shut down (queued downloads cancelled)
+    before the error is raised, so whatever is already in `sink` can
+    still be finished. Returns the rows that could not be downloaded.
+    """
+    on_progress = on_progress or _no_progress
+    headers = coretax.auth_headers(token)
+    limiter = coretax.get_limiter("download")
+    url = coretax.BASE_URL + BUPOT_DOWNLOAD_URL
+
+    def fetch_pdf(row):
+        payload = {
+            "DocumentId": row["DocumentNumber"],
+            "TaxpayerAggregateIdentifier": f"{taxpayer_id}",
+            "IsNeedWatermark": True,
+            "FormCallerName": "TaxpayerDocuments",
+            "DocumentAggregateIdentifier": row["AggregateIdentifier"]
+        }
+        # Stream straight to the archive's staging dir; the file is
+        # checked as it arrives and never held in memory
+        path = sink.stage()
+        with coretax.post(url, headers=headers, json=payload, limiter=limiter, stream=True) as resp:
+            resp.raise_for_status()
+            download.save_pdf(resp.iter_content(download.CHUNK_SIZE), path)
+
+        sink.add_file(f"{row['LetterNumber']}.pdf", path)
+
+    fails = []
+    completed = 0
+    with heartbeat.hold(token):
+        executor = ThreadPoolExecutor(max_workers=limiter.maximum)
+        try:
+            futures = [executor.submit(_download, fetch_pdf, row) for row in rows]
+            for future in as_completed(futures):
+                result = future.result()
+                completed += 1
+                on_progress("download", completed, len(rows))
+                if not result["success"]:
+                    fails.append(result["row"])
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return fails
+
+def _close(sink):
+    """The finished archive opened for reading, or None (and nothing kept) when it is empty."""
+    if sink.count:
+        return sink.finish()
+    sink.discard()
+    return None
+
+def archive_a1(token, taxpayer_id, taxperiods, on_progress=None):
+    """
+    download_a1 into a new archive.ZipSink, for a background job.
+    Returns (the sink, its archive opened for reading or None when
+    nothing was downloaded, failed rows, [(taxperiod, exc)] of periods
+    whose listing failed).
+    """
+    sink = archive.ZipSink()
+    list_errors = []
+    try:
+        fails = download_a1(
+            token,
+            taxpayer_id,
+            taxperiods,
+            sink,
+            on_progress=on_progress,
+            on_list_error=lambda taxperiod, e: list_errors.append((taxperiod, e))
+        )
+    except BaseException:
+        sink.discard()
+        raise
+    return sink, _close(sink), fails, list_errors
+
+def archive_bupot(token, taxpayer_id, search_key, start, end, on_progress=None):
+    """
+    list_bupot and download_bupot into a new archive.ZipSink, for a
+    background job. If the downloads break off, what had already arrived
+    is still archived and the error is returned rather than raised.
+    Returns (listed rows, the sink, its archive opened for reading or
+    None when empty, failed rows, error or None).
+    """
+    rows = list_bupot(token, taxpayer_id, search_key, start, end)
+    sink = archive.ZipSink()
+    fails = []
+    error = None
+    try:
+        fails = download_bupot(token, taxpayer_id, rows, sink, on_progress=on_progress)
+    except Exception as e:
+        error = e
+    except BaseException:
+        # cancelled: nothing is kept
+        sink.discard()
+        raise
+    return rows, sink, _close(sink), fails, error
@@ -0,0 +1,146 @@
+import pandas as pd
+import pyarrow as pa
+from . import coretax
+
+# Output layout shared by every e-invoice export
+COLUMNS = [
+    "tanggal", "nota", "relasi", "kode", "qtybox", "qtylsn", "qtypcs",
+    "hrgbox", "hrglsn", "hrgpcs", "discount", "ppn", "sptmasa", "jmldpp",
+    "jmlppn", "nmsup", "nmbrg", "divisi", "ref",
+]
+NUMERIC_COLUMNS = ["qtypcs", "hrgpcs", "discount", "ppn", "jmlppn"]
+BLANK_COLUMNS = ["kode", "qtybox", "qtylsn", "hrgbox", "hrglsn", "jmldpp"]    # filled in later or by hand
+
+# All that is kept of a `view` payload between fetching and exporting
+SCHEMA = pa.schema([
+    (col, pa.float64() if col in NUMERIC_COLUMNS else pa.string())
+    for col in COLUMNS if col not in BLANK_COLUMNS
+])
+
+# Typed layout of the Parquet / Arrow / CSV downloads, identical for all four reports
+DATE_COLUMNS = ["tanggal", "sptmasa"]
+TEXT_COLUMNS = ["nota", "relasi", "kode", "nmsup", "nmbrg", "divisi", "ref"]
+EXPORT_SCHEMA = pa.schema([
+    (col, pa.date32() if col in DATE_COLUMNS else pa.string() if col in TEXT_COLUMNS else pa.float64())
+    for col in COLUMNS
+])
+
+# Per report: which payload field fills which column.
+#   header   - top level of the view payload
+#   document - FormDataObj.TransactionDocumentData
+#   line     - each row of FormDataObj.TransactionDetailsData.Rows, (field, default)
+#   period / year - TransactionDocumentData fields that give sptmasa
+INPUT_INVOICE = {
+    "header": {"relasi": "SellerTIN", "nmsup": "SellerName", "divisi": "BuyerStatus"},
+    "document": {"tanggal": "InvoiceDate", "nota": "TaxInvoiceNumber", "ref": "Reference"},
+    "line": {
+        "qtypcs": ("Quantity", 0),
+        "hrgpcs": ("UnitPrice", 0),
+        "discount": ("Discount", 0),
+        "ppn": ("VATRate", 0),
+        "jmlppn": ("VAT", 0),
+        "nmbrg": ("Name", ""),
+    },
+    "period": "PeriodCredit",
+    "year": "YearCredit",
+}
+
+OUTPUT_INVOICE = {
+    **INPUT_INVOICE,
+    "header": {"relasi": "BuyerTIN", "nmsup": "BuyerName", "divisi": "InvoiceStatus"},
+    "period": "Period",
+    "year": "Year",
+}
+
+INPUT_RETURN = {
+    "header": {"relasi": "SellerTIN", "nmsup": "SellerTaxpayerName", "divisi": "InvoiceStatus"},
+    "document": {"tanggal": "ReturnDate", "nota": "ReturnDocumentNumber", "ref": "Reference"},
+    "line": {
+        "qtypcs": ("ReturnQuantity", 0),
+        "hrgpcs": ("UnitPrice", 0),
+        "discount": ("ReturnDiscount", 0),
+        "ppn": ("VATRate", 0),
+        "jmlppn": ("ReturnVAT", 0),
+        "nmbrg": ("Name", ""),
+    },
+    "period": "Period",
+    "year": "Year",
+}
+
+OUTPUT_RETURN = {
+    **INPUT_RETURN,
+    "header": {"relasi": "BuyerTIN", "nmsup": "BuyerTaxpayerName", "divisi": "InvoiceStatus"},
+    "period": "TaxInvoicePeriod",
+    "year": "TaxInvoiceYear",
+}
+
+def _text(values):
+    return [v if v is None or isinstance(v, str) else str(v) for v in values]
+
+def invoice_batch(payloads, spec):
+    """
+    Project `view` payloads down to one row per line item holding only the
+    SCHEMA columns, as a pyarrow RecordBatch.
+    Each payload is walked once: its header and document values are looked
+    up a single time and repeated for all of its lines, while line values
+    are appended column by column.
+    """
+    columns = {col: [] for col in SCHEMA.names}
+    header_fields = spec["header"].items()
+    document_fields = spec["document"].items()
+    line_fields = spec["line"].items()
+
+    for payload in payloads:
+        form = payload.get("FormDataObj") or {}
+        lines = (form.get("TransactionDetailsData") or {}).get("Rows") or []
+        n = len(lines)
+        if not n:
+            continue
+        document = form.get("TransactionDocumentData") or {}
+
+        for col, field in header_fields:
+            columns[col].extend([payload.get(field, "")] * n)
+        for col, field in document_fields:
+            columns[col].extend([document.get(field, "")] * n)
+        sptmasa = coretax.get_period_end_date(document.get(spec["period"], ""), document.get(spec["year"], ""))
+        columns["sptmasa"].extend([sptmasa] * n)
+        for col, (field, default) in line_fields:
+            columns[col].extend([d.get(field, default) for d in lines])
+
+    arrays = []
+    for field in SCHEMA:
+        values = columns[field.name]
+        if pa.types.is_floating(field.type):
+            values = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+        else:
+            values = _text(values)
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=SCHEMA)
+
+def to_frame(batches):
+    """DataFrame in COLUMNS order from invoice_batch() output, blank columns filled with ''."""
+    table = pa.Table.from_batches(batches, schema=SCHEMA)
+    return table.to_pandas().reindex(columns=COLUMNS, fill_value="")
+
+def flatten_invoices(payloads, spec):
+    """One row per line item of every `view` payload, in COLUMNS order."""
+    return to_frame([invoice_batch(payloads, spec)])
+
+def derive_columns(df, positive_only=False):
+    """
+    Fill the derived columns of a flatten_invoices() frame for the whole
+    column at once: tanggal as YYYY/MM/DD (blank when unparseable) and
+    jmldpp = hrgpcs * qtypcs - discount. With positive_only (returns),
+    lines with no returned quantity are dropped first.
+    """
+    try:
+        dates = pd.to_datetime(df["tanggal"], format="ISO8601", errors="coerce")
+        df["tanggal"] = dates.dt.strftime("%Y/%m/%d").fillna("")
+    except (TypeError, ValueError):
+        # e.g. mixed timezone offsets, which a single parse refuses
+        df["tanggal"] = df["tanggal"].apply(coretax.format_date)
+
+    if positive_only:
+        df = df[df["qtypcs"] > 0].copy()
+    df["jmldpp"] = df["hrgpcs"] * df["qtypcs"] - df["discount"]
+    return df
@@ -0,0 +1,101 @@
+import contextlib
+import os
+import threading
+import time
+import requests
+from . import coretax
+
+KEEPALIVE_INTERVAL = float(os.environ.get("CORETAX_KEEPALIVE_INTERVAL", 240))     # seconds between pings of a token
+
+_sessions = {}
+_lock = threading.Lock()
+
+class Session:
+    """
+    SessionKeepAlive pings for one bearer token, sent from a daemon
+    thread at most once per KEEPALIVE_INTERVAL. The thread runs while
+    the token is held (see hold) or a ping was asked for (see touch).
+    Once a whole interval has passed since the last ping with neither,
+    it stops and the Session, token included, is forgotten.
+    `status` is the HTTP status of the last ping, `error` its
+    connection error, `last_ping` when it was sent.
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.holders = 0
+        self.status = None
+        self.error = None
+        self.last_ping = 0.0
+        self._requested = False
+        self._thread = None
+        self._wake = threading.Event()
+
+    def _start(self):
+        # called with _lock held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="coretax-keepalive", daemon=True)
+            self._thread.start()
+        else:
+            self._wake.set()
+
+    def _ping(self):
+        try:
+            self.status = coretax.keepalive(self.token)
+            self.error = None
+        except requests.exceptions.RequestException as e:
+            self.error = e
+        # a failed ping waits for the next interval too, rather than hammering
+        self.last_ping = time.time()
+
+    def _run(self):
+        while True:
+            with _lock:
+                due = self.last_ping + KEEPALIVE_INTERVAL - time.time()
+                if due <= 0 and self.holders == 0 and not self._requested:
+                    # idle for a whole interval: nothing keeps the token any longer
+                    self._thread = None
+                    if _sessions.get(self.token) is self:
+                        del _sessions[self.token]
+                    return
+                if due <= 0:
+                    self._requested = False
+            if due <= 0:
+                self._ping()
+                continue
+            self._wake.wait(due)
+            self._wake.clear()
+
+def _session(token):
+    # called with _lock held
+    if token not in _sessions:
+        _sessions[token] = Session(token)
+    return _sessions[token]
+
+@contextlib.contextmanager
+def hold(token):
+    """Keep the token's Coretax session alive in the background for the with block."""
+    with _lock:
+        session = _session(token)
+        session.holders += 1
+        session._start()
+    try:
+        yield session
+    finally:
+        with _lock:
+            session.holders -= 1
+            if session.holders == 0:
+                session._wake.set()
+
+def touch(token):
+    """
+    Ping the token in the background if no ping went out within
+    KEEPALIVE_INTERVAL; never blocks. Returns its Session, whose status
+    may still be from the previous ping.
+    """
+    with _lock:
+        session = _session(token)
+        if session.last_ping + KEEPALIVE_INTERVAL <= time.time():
+            session._requested = True
+            session._start()
+    return session
@@ -0,0 +1,119 @@
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_JOBS = int(os.environ.get("CORETAX_JOBS", 4))             # background extractions running at once
+JOB_TTL = float(os.environ.get("CORETAX_JOB_TTL", 3600))      # seconds a finished job is kept for its page
+SWEEP_SECONDS = 60      # how often expired jobs are dropped when nothing else looks at the table
+
+_jobs = {}
+_executor = None
+_sweeper = None
+_lock = threading.Lock()
+
+class Cancelled(BaseException):
+    """
+    Raised from a job's on_progress once the job has been cancelled.
+    Not an Exception, so code that keeps partial results on errors
+    (e.g. extract.archive_bupot) does not mistake it for one.
+    """
+
+class Job:
+    """
+    One extraction running on the process-wide job pool, independent of
+    the Streamlit script run (and session) that started it.
+    `state` goes from "queued" to "running" and ends as "done", "error"
+    or "cancelled"; `stage` and `progress` ({stage: (done, total)}) follow
+    the extraction's on_progress, `result` is what it returned (kept
+    for JOB_TTL, so extractions return compact results such as Arrow
+    batches or archives on disk rather than DataFrames; open files in
+    it are closed when the job is dropped) and `error` the exception
+    it raised.
+    """
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.state = "queued"
+        self.stage = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def cancel(self):
+        """Stop at the next progress report; the job ends as "cancelled"."""
+        self._cancel.set()
+
+    def on_progress(self, stage, done, total):
+        if self._cancel.is_set():
+            raise Cancelled()
+        self.progress[stage] = (done, total)
+        self.stage = stage
+
+    def _run(self, fn, args, kwargs):
+        try:
+            if self._cancel.is_set():
+                raise Cancelled()
+            self.state = "running"
+            self.result = fn(*args, on_progress=self.on_progress, **kwargs)
+            self.state = "done"
+        except Cancelled:
+            self.state = "cancelled"
+        except Exception as e:
+            self.error = e
+            self.state = "error"
+        finally:
+            self.finished = time.time()
+
+def _close_result(result):
+    # archives come back as open, already unlinked temp files (see extract.archive_a1)
+    for item in result if isinstance(result, tuple) else (result,):
+        if isinstance(item, io.IOBase):
+            item.close()
+
+def _expire():
+    # called with _lock held
+    cutoff = time.time() - JOB_TTL
+    for job_id in [job_id for job_id, job in _jobs.items() if job.finished and job.finished < cutoff]:
+        _close_result(_jobs.pop(job_id).result)
+
+def _sweep():
+    while True:
+        time.sleep(SWEEP_SECONDS)
+        with _lock:
+            _expire()
+
+def submit(name, fn, *args, **kwargs):
+    """
+    Run fn(*args, on_progress=..., **kwargs) on the job pool and return
+    its Job straight away. fn must not touch Streamlit: it outlives the
+    script run, and its progress is only read back through the Job.
+    """
+    global _executor, _sweeper
+    job = Job(name)
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_JOBS, thread_name_prefix="coretax-job")
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep, name="coretax-job-sweeper", daemon=True)
+            _sweeper.start()
+        _expire()
+        _jobs[job.id] = job
+    _executor.submit(job._run, fn, args, kwargs)
+    return job
+
+def get(job_id):
+    """The Job with this id, or None once it has expired (or for None)."""
+    with _lock:
+        _expire()
+        return _jobs.get(job_id)
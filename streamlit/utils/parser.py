@@ -1,4 +1,20 @@
 import pandas as pd
+import pyarrow as pa
+
+# Columns kept from each lampiran grid, per sheet
+SHEET_COLUMNS = {
+    "A-1": ["Name", "DocumentNumber", "DocumentDate", "TaxBase", "Information"],
+    "A-2": ["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "OtherTaxBase", "VAT", "STLG", "TaxInvoiceCode", "DocumentNumberByBuyerInfor"],
+    "B-1": ["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "VAT", "STLG", "Information"],
+    "B-2": ["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "OtherTaxBase", "VAT", "STLG", "TaxInvoiceCode"],
+    "B-3": ["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "OtherTaxBase", "VAT", "STLG", "TaxInvoiceCode"],
+    "L-IA": ["TIN", "Name", "WithholdingSlipsNumber", "WithholdingSlipsDate", "TaxObjectCode", "GrossIncome", "TaxRate", "IncomeTax", "TaxCertificate", "CountryCode", "PlaceOfBusinessID", "RevenueCode", "Status"],
+    "L-IB A1": ["TIN", "Name", "WithholdingNumber", "WithholdingDate", "TaxObjectCode", "GrossIncome", "IncomeTax", "TaxCertificate", "CountryCode", "PlaceOfBusinessID", "RevenueCode", "Status"],
+    "L-II A1": ["TIN", "Name", "WithholdingNumber", "WithholdingDate", "TaxObjectCode", "GrossIncome", "IncomeTax", "IncomePeriod", "CountryCode", "PlaceOfBusinessID", "Status"],
+    "L-III": ["TIN", "Name", "TaxArticle", "WithholdingNumber", "WithholdingDate", "TaxObjectCode", "TaxObject", "GrossIncome", "IncomeTax", "TaxCertificate", "PlaceOfBusinessID", "RevenueCode", "Status"],
+    "DAFTAR-I": ["TaxIdentificationNumber", "TaxpayerName", "WithholdingSlipsNumber", "WithholdingSlipsDate", "TaxArticle", "TaxObjectCode", "TaxObject", "TaxBase", "TaxRate", "IncomeTax", "TaxCertificate", "PaymentMethod", "BranchId", "Status", "RevenueCode"],
+}
+NUMERIC_COLUMNS = {"TaxBase", "OtherTaxBase", "VAT", "STLG", "GrossIncome", "TaxRate", "IncomeTax"}
 
 def clean_taxcertificate(df):
     if "TaxCertificate" in df.columns:
@@ -6,6 +22,22 @@ def clean_taxcertificate(df):
         df.loc[df["TaxCertificate"] == "9", "TaxCertificate"] = "Tanpa Fasilitas"
     return df
 
+def lampiran_schema(sheet):
+    """
+    Fixed Arrow schema of one lampiran sheet for Parquet / Arrow / CSV
+    exports: the page's Masa column, then SHEET_COLUMNS with amounts as
+    float64, *Date columns as timestamps and everything else as text.
+    """
+    fields = [("Masa", pa.int64())]
+    for col in SHEET_COLUMNS[sheet]:
+        if col in NUMERIC_COLUMNS:
+            fields.append((col, pa.float64()))
+        elif col.endswith("Date"):
+            fields.append((col, pa.timestamp("ms")))
+        else:
+            fields.append((col, pa.string()))
+    return pa.schema(fields)
+
 def parse_lampiran(spt_choice,details):
     """Parse list of invoice JSON payloads into multiple DataFrames."""
     dfs = {}
@@ -23,10 +55,10 @@ def parse_lampiran(spt_choice,details):
                     df_a1 = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_a1 = pd.DataFrame(records)[["Name", "DocumentNumber", "DocumentDate", "TaxBase", "Information"]]
+                    df_a1 = pd.DataFrame(records)[SHEET_COLUMNS["A-1"]]
             except Exception as e:
                 print("Error parsing df_a1:", e)
-                df_a1 = pd.DataFrame(columns=["Name", "DocumentNumber", "DocumentDate", "TaxBase", "Information"])
+                df_a1 = pd.DataFrame(columns=SHEET_COLUMNS["A-1"])
 
             # --- A-2 ---
             try:
@@ -35,10 +67,10 @@ def parse_lampiran(spt_choice,details):
                     df_a2 = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_a2 = pd.DataFrame(records)[["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "OtherTaxBase", "VAT","STLG", "TaxInvoiceCode","DocumentNumberByBuyerInfor"]]
+                    df_a2 = pd.DataFrame(records)[SHEET_COLUMNS["A-2"]]
             except Exception as e:
                 print("Error parsing df_a2:", e)
-                df_a2 = pd.DataFrame(columns=["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "OtherTaxBase", "VAT","STLG", "TaxInvoiceCode","DocumentNumberByBuyerInfor"])
+                df_a2 = pd.DataFrame(columns=SHEET_COLUMNS["A-2"])
                 
             # --- B-1 ---
             try:
@@ -47,10 +79,10 @@ def parse_lampiran(spt_choice,details):
                     df_b1 = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_b1 = pd.DataFrame(records)[["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "VAT","STLG", "Information"]]
+                    df_b1 = pd.DataFrame(records)[SHEET_COLUMNS["B-1"]]
             except Exception as e:
                 print("Error parsing df_b1:", e)
-                df_b1 = pd.DataFrame(columns=["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "VAT","STLG", "Information"])
+                df_b1 = pd.DataFrame(columns=SHEET_COLUMNS["B-1"])
                 
             # --- B-2 ---
             try:
@@ -59,10 +91,10 @@ def parse_lampiran(spt_choice,details):
                     df_b2 = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_b2 = pd.DataFrame(records)[["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase","OtherTaxBase", "VAT","STLG","TaxInvoiceCode"]]
+                    df_b2 = pd.DataFrame(records)[SHEET_COLUMNS["B-2"]]
             except Exception as e:
                 print("Error parsing df_b2:", e)
-                df_b2 = pd.DataFrame(columns=["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase","OtherTaxBase", "VAT","STLG","TaxInvoiceCode"])    
+                df_b2 = pd.DataFrame(columns=SHEET_COLUMNS["B-2"])    
             
            # --- B-3 ---
             try:
@@ -71,10 +103,10 @@ def parse_lampiran(spt_choice,details):
                     df_b3 = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_b3 = pd.DataFrame(records)[["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "OtherTaxBase", "VAT","STLG","TaxInvoiceCode"]]
+                    df_b3 = pd.DataFrame(records)[SHEET_COLUMNS["B-3"]]
             except Exception as e:
                 print("Error parsing df_b3:", e)
-                df_b3 = pd.DataFrame(columns=["Name", "TIN", "DocumentNumber", "DocumentDate", "TaxBase", "OtherTaxBase", "VAT","STLG","TaxInvoiceCode"])
+                df_b3 = pd.DataFrame(columns=SHEET_COLUMNS["B-3"])
             
             dfs = {
                 "A-1":df_a1,
@@ -91,11 +123,11 @@ def parse_lampiran(spt_choice,details):
                     df_l1a = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_l1a = pd.DataFrame(records)[["TIN", "Name", "WithholdingSlipsNumber", "WithholdingSlipsDate", "TaxObjectCode","GrossIncome", "TaxRate", "IncomeTax","TaxCertificate", "CountryCode","PlaceOfBusinessID", "RevenueCode", "Status"]]
+                    df_l1a = pd.DataFrame(records)[SHEET_COLUMNS["L-IA"]]
                     df_l1a = clean_taxcertificate(df_l1a)
             except Exception as e:
                 print("Error parsing df_l1a:", e)
-                df_l1a = pd.DataFrame(columns=["TIN", "Name", "WithholdingSlipsNumber", "WithholdingSlipsDate", "TaxObjectCode","GrossIncome", "TaxRate", "IncomeTax","TaxCertificate", "CountryCode","PlaceOfBusinessID", "RevenueCode", "Status"])
+                df_l1a = pd.DataFrame(columns=SHEET_COLUMNS["L-IA"])
                 
             # --- L-IB A1 ---
             try:
@@ -104,11 +136,11 @@ def parse_lampiran(spt_choice,details):
                     df_l1b = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_l1b = pd.DataFrame(records)[["TIN", "Name", "WithholdingNumber", "WithholdingDate", "TaxObjectCode","GrossIncome", "IncomeTax","TaxCertificate", "CountryCode","PlaceOfBusinessID", "RevenueCode", "Status"]]
+                    df_l1b = pd.DataFrame(records)[SHEET_COLUMNS["L-IB A1"]]
                     df_l1b = clean_taxcertificate(df_l1b)
             except Exception as e:
                 print("Error parsing df_l1b:", e)
-                df_l1b = pd.DataFrame(columns=["TIN", "Name", "WithholdingNumber", "WithholdingDate", "TaxObjectCode","GrossIncome", "IncomeTax","TaxCertificate", "CountryCode","PlaceOfBusinessID", "RevenueCode", "Status"])
+                df_l1b = pd.DataFrame(columns=SHEET_COLUMNS["L-IB A1"])
                 
             # --- L-II A1 ---
             try:
@@ -117,10 +149,10 @@ def parse_lampiran(spt_choice,details):
                     df_l2 = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_l2 = pd.DataFrame(records)[["TIN", "Name", "WithholdingNumber", "WithholdingDate", "TaxObjectCode","GrossIncome", "IncomeTax","IncomePeriod", "CountryCode","PlaceOfBusinessID", "Status"]]
+                    df_l2 = pd.DataFrame(records)[SHEET_COLUMNS["L-II A1"]]
             except Exception as e:
                 print("Error parsing df_l2:", e)
-                df_l2 = pd.DataFrame(columns=["TIN", "Name", "WithholdingNumber", "WithholdingDate", "TaxObjectCode","GrossIncome", "IncomeTax","IncomePeriod", "CountryCode","PlaceOfBusinessID", "Status"])
+                df_l2 = pd.DataFrame(columns=SHEET_COLUMNS["L-II A1"])
 
             # --- L-III ---
             try:
@@ -129,11 +161,11 @@ def parse_lampiran(spt_choice,details):
                     df_l3 = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_l3 = pd.DataFrame(records)[["TIN", "Name", "TaxArticle", "WithholdingNumber", "WithholdingDate", "TaxObjectCode", "TaxObject", "GrossIncome", "IncomeTax","TaxCertificate","PlaceOfBusinessID", "RevenueCode", "Status"]]
+                    df_l3 = pd.DataFrame(records)[SHEET_COLUMNS["L-III"]]
                     df_l3 = clean_taxcertificate(df_l3)
             except Exception as e:
                 print("Error parsing df_l3:", e)
-                df_l3 = pd.DataFrame(columns=["TIN", "Name", "TaxArticle", "WithholdingNumber", "WithholdingDate", "TaxObjectCode", "TaxObject", "GrossIncome", "IncomeTax","TaxCertificate","PlaceOfBusinessID", "RevenueCode", "Status"])
+                df_l3 = pd.DataFrame(columns=SHEET_COLUMNS["L-III"])
             
             dfs = {
                 "L-IA":df_l1a,
@@ -149,11 +181,11 @@ def parse_lampiran(spt_choice,details):
                     df_bppu = pd.DataFrame()
                 else:
                     records = raw_data.get("Data", []) if isinstance(raw_data, dict) else []
-                    df_bppu = pd.DataFrame(records)[["TaxIdentificationNumber", "TaxpayerName", "WithholdingSlipsNumber", "WithholdingSlipsDate","TaxArticle", "TaxObjectCode", "TaxObject", "TaxBase", "TaxRate", "IncomeTax","TaxCertificate", "PaymentMethod","BranchId", "Status", "RevenueCode"]]
+                    df_bppu = pd.DataFrame(records)[SHEET_COLUMNS["DAFTAR-I"]]
                     df_bppu = clean_taxcertificate(df_bppu)
             except Exception as e:
                 print("Error parsing df_bppu:", e)
-                df_bppu = pd.DataFrame(columns=["TaxIdentificationNumber", "TaxpayerName", "WithholdingSlipsNumber", "WithholdingSlipsDate","TaxArticle", "TaxObjectCode", "TaxObject", "TaxBase", "TaxRate", "IncomeTax","TaxCertificate", "PaymentMethod","BranchId", "Status", "RevenueCode"])
+                df_bppu = pd.DataFrame(columns=SHEET_COLUMNS["DAFTAR-I"])
             
             dfs = {
                 "DAFTAR-I":df_bppu,
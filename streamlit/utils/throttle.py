@@ -0,0 +1,192 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+OK = "ok"
+ERROR = "error"          # request failed for its own reasons (404, bad payload, ...)
+OVERLOAD = "overload"    # server is struggling: timeout, connection drop, 429, 5xx
+
+def status_of(exc):
+    """HTTP status carried by a requests or aiohttp error, else None."""
+    return getattr(getattr(exc, "response", None), "status_code", None) or getattr(exc, "status", None)
+
+def is_transport_error(exc):
+    name = type(exc).__name__
+    return (
+        "Timeout" in name
+        or "Connection" in name
+        or "Disconnected" in name
+        or isinstance(exc, asyncio.TimeoutError)
+    )
+
+def classify(status_code=None, exc=None):
+    """Map a response status / exception to OK, ERROR or OVERLOAD."""
+    if exc is not None:
+        if is_transport_error(exc):
+            return OVERLOAD
+        status_code = status_of(exc)
+        if status_code is None:
+            return ERROR
+    if status_code == 429 or (status_code is not None and status_code >= 500):
+        return OVERLOAD
+    if status_code is not None and status_code >= 400:
+        return ERROR
+    return OK
+
+def is_retryable(exc):
+    """
+    Timeouts, dropped connections, 408, 429 and 5xx are worth another try.
+    Other 4xx (401/403 expired token, 404 missing record) will fail the same
+    way again. Errors without a status (e.g. a truncated JSON body) are
+    treated as transient.
+    """
+    if is_transport_error(exc):
+        return True
+    status = status_of(exc)
+    if status is None:
+        return True
+    return status in (408, 429) or status >= 500
+
+def retry_after(exc):
+    """Seconds requested by a Retry-After header on the failed response, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt, exc=None, base_delay=1.0, max_delay=30.0):
+    """
+    Delay before retry number `attempt` (1-based): the server's Retry-After
+    when given, otherwise exponential backoff with full jitter.
+    """
+    requested = retry_after(exc) if exc is not None else None
+    if requested is not None:
+        return min(requested, max_delay * 4)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on in-flight requests.
+    Every healthy completion grows the limit by 1/limit (about +1 per round
+    of requests) while the p95 latency and error rate of the recent window
+    stay under target. Timeouts, 429s and 5xx cut the limit by `backoff`,
+    at most once per `cooldown` seconds so one burst of failures does not
+    collapse it to the minimum.
+    """
+
+    def __init__(
+        self,
+        initial,
+        minimum=1,
+        maximum=64,
+        target_p95=8.0,
+        max_error_rate=0.05,
+        window=50,
+        backoff=0.5,
+        cooldown=2.0
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.target_p95 = target_p95
+        self.max_error_rate = max_error_rate
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = deque()      # (loop, future) of coroutines waiting in acquire_async
+
+    def try_acquire(self):
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        """
+        Wait for a slot without blocking the event loop. Waiting coroutines
+        queue up in order and release() hands each freed slot straight to
+        the next one through its loop, so nothing polls.
+        """
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if not self._async_waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            waiter = loop.create_future()
+            self._async_waiters.append((loop, waiter))
+        await waiter
+
+    def _wake_async(self):
+        # called with _cond held: the slot is taken on the waiter's behalf
+        while self._async_waiters and self.in_flight < int(self.limit):
+            loop, waiter = self._async_waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            loop.call_soon_threadsafe(self._hand_over, waiter)
+
+    def _hand_over(self, waiter):
+        if waiter.done():
+            # cancelled after the slot was taken for it: give the slot back
+            with self._cond:
+                self.in_flight -= 1
+                self._wake_async()
+                self._cond.notify_all()
+        else:
+            waiter.set_result(None)
+
+    def release(self, latency, outcome=OK):
+        with self._cond:
+            self.in_flight -= 1
+            self._outcomes.append(outcome)
+            now = time.monotonic()
+
+            if outcome == OVERLOAD:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+            else:
+                self._latencies.append(latency)
+                if outcome == OK and self._healthy():
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+            self._wake_async()
+            self._cond.notify_all()
+
+    def _healthy(self):
+        if not self._latencies:
+            return True
+        ordered = sorted(self._latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        errors = sum(1 for o in self._outcomes if o != OK)
+        return p95 <= self.target_p95 and errors / len(self._outcomes) <= self.max_error_rate
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "healthy": self._healthy(),
+            }